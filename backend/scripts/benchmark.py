@@ -0,0 +1,1036 @@
+"""
+Benchmarks for the PDF question extraction pipeline (pdf_to_excel.py)
+
+    python benchmark.py pipeline [pdf ...] [--synthetic-pages 1000] [--output results.json]
+    python benchmark.py synth out.pdf --pages 10000
+    python benchmark.py tokenizer [pdf ...]
+    python benchmark.py backends [pdf ...]
+    python benchmark.py records [--questions 10000]
+    python benchmark.py dedupe [--corpus 200000 --upload 5000]
+    python benchmark.py shards [--questions 20000]
+    python benchmark.py publish [pdf ...]
+
+pipeline reports time and peak memory per stage, pages/sec and whether the
+output still matches the stored golden file; results are machine-readable
+JSON so runs can be compared over time
+"""
+
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import openpyxl
+import pdfplumber
+
+import pdf_to_excel
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+SAMPLE_PDFS = [SCRIPT_DIR / "sample_questions.pdf", SCRIPT_DIR / "sample_questions-old.pdf"]
+
+# Stored expected output per sample PDF
+GOLDEN_FILES = {
+    "sample_questions.pdf": SCRIPT_DIR / "questions_output.json",
+}
+
+
+# Reference implementations: the per-extractor split/re.match parsing that
+# tokenize_page replaced. Kept here to measure against and to check that the
+# tokenizer output is unchanged.
+
+def legacy_page_fields(text: str) -> Dict:
+    lines = text.strip().split('\n')
+
+    question_lines = []
+    for line in lines:
+        line = line.strip()
+        if re.match(r'^[A-Ea-e][\.\)]', line):
+            break
+        if line and len(line) > 3:
+            question_lines.append(line)
+
+    options = {}
+    for line in lines:
+        line = line.strip()
+        match = re.match(r'^([A-Ea-e])[\.\)]\s*(.+)', line)
+        if match:
+            options[match.group(1).upper()] = match.group(2).strip()
+
+    explanation_lines = []
+    option_count = 0
+    for line in lines:
+        line = line.strip()
+        if re.match(r'^[A-E]\.', line):
+            option_count += 1
+        if option_count >= 8 and line and len(line) > 3 and not re.match(r'^[A-E]\.', line):
+            explanation_lines.append(line)
+
+    category_key = ""
+    for line in reversed(lines):
+        line = line.strip()
+        if re.match(r'^[A-Z][a-z]$', line) or re.match(r'^[A-Z]{2}$', line):
+            category_key = line
+            break
+
+    raw_option_count = len(re.findall(r'^[A-Ea-e][\.\)]', text, re.MULTILINE))
+    has_category_key = any(re.match(r'^[A-Z]{2}$', line.strip()) for line in lines[-3:])
+    first_line = lines[0].strip() if lines else ""
+    is_single_answer = bool(re.match(r'^[A-Ea-e][\.\)]', first_line)) and raw_option_count == 1
+
+    # Lettered answer, else the answer text that gets matched against the
+    # options (matching itself is AnswerMatcher's job, not the tokenizer's)
+    answer = ""
+    match = re.match(r'^([A-Ea-e])[\.\)]\s*', first_line)
+    if match:
+        answer = match.group(1).upper()
+    else:
+        answer_text = []
+        for line in lines:
+            line = line.strip()
+            if re.match(r'^[A-Z][a-z]$', line) or re.match(r'^[A-Z]{2}$', line):
+                break
+            if line and len(line) > 2:
+                answer_text.append(line)
+        answer = ' '.join(answer_text).strip()
+
+    return {
+        'question': ' '.join(question_lines).strip(),
+        'options': options,
+        'explanation': ' '.join(explanation_lines).strip(),
+        'category_key': category_key,
+        'raw_option_count': raw_option_count,
+        'has_category_key': has_category_key,
+        'is_single_answer': is_single_answer,
+        'answer': answer,
+    }
+
+
+def tokenized_page_fields(text: str) -> Dict:
+    model = pdf_to_excel.tokenize_page(text)
+    options = pdf_to_excel.extract_options(model)
+    return {
+        'question': pdf_to_excel.extract_question(model),
+        'options': options,
+        'explanation': pdf_to_excel.extract_explanation(model),
+        'category_key': model.category_key,
+        'raw_option_count': model.raw_option_count,
+        'has_category_key': model.has_category_key,
+        'is_single_answer': model.kinds[0] == pdf_to_excel.LINE_OPTION and model.raw_option_count == 1,
+        'answer': model.lines[0][0].upper() if model.kinds[0] == pdf_to_excel.LINE_OPTION
+        else pdf_to_excel.answer_page_text(model),
+    }
+
+
+# Hand-written pages covering layouts the sample PDFs don't have
+EDGE_CASE_TEXTS = [
+    "",
+    "   \n\n  ",
+    "\n\n  A. Leading blank lines\nB) second\n  c. indented\nRE\n\n",
+    "Question text here?\nA.\nB. Only marker above\nCa",
+    " A. indented first option\nMa",
+    "Explanation\nA. one\nB. two\nC. three\nD. four\nA. one\nB. two\nC. three\nD. four\nThe answer is B\nxyz\nEN",
+    "Emergency thoracotomy\nEt\nC. Emergency thoracotomy",
+]
+
+
+def load_page_texts(pdf_paths) -> List[str]:
+    texts = []
+    for pdf_path in pdf_paths:
+        with pdfplumber.open(pdf_path) as pdf:
+            texts.extend(page.extract_text() or '' for page in pdf.pages)
+    return texts
+
+
+def time_per_page(func, texts: List[str], repeat: int) -> float:
+    """Best-of-repeat seconds for one pass over all texts"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_tokenizer(pdf_paths, repeat: int = 50) -> Dict:
+    """
+    Micro-benchmark: legacy per-extractor parsing vs the single-pass tokenizer
+    on real page text; fails if any page parses differently
+    """
+    texts = load_page_texts(pdf_paths) + EDGE_CASE_TEXTS
+
+    for text in texts:
+        expected, actual = legacy_page_fields(text), tokenized_page_fields(text)
+        if expected != actual:
+            raise AssertionError(f"Tokenizer mismatch for page text {text[:60]!r}: {expected} != {actual}")
+
+    legacy = time_per_page(legacy_page_fields, texts, repeat)
+    tokenized = time_per_page(tokenized_page_fields, texts, repeat)
+    return {
+        'pages': len(texts),
+        'legacy_us_per_page': round(legacy / len(texts) * 1e6, 2),
+        'tokenizer_us_per_page': round(tokenized / len(texts) * 1e6, 2),
+        'speedup': round(legacy / tokenized, 2),
+    }
+
+
+def compare_backends(pdf_paths) -> Dict:
+    """
+    Equivalence check: every text backend must produce the same page text,
+    image presence and page type as pdfplumber; fails on the first mismatch.
+    Also reports the analysis time per backend, and the pages the --probe
+    pass classifies differently (reported, not a failure: probe types only
+    steer grouping)
+    """
+    documents = []
+    for pdf_path in pdf_paths:
+        records = {}
+        seconds = {}
+        for backend in pdf_to_excel.TEXT_BACKENDS:
+            with contextlib.redirect_stdout(io.StringIO()):  # fitz import warning
+                with pdf_to_excel.open_pdf(str(pdf_path), backend) as pdf:
+                    start = time.perf_counter()
+                    records[backend] = [pdf_to_excel.analyze_page(page, index) for index, page in enumerate(pdf.pages)]
+                    seconds[backend] = round(time.perf_counter() - start, 4)
+
+        reference = records['pdfplumber']
+        for backend, pages in records.items():
+            if len(pages) != len(reference):
+                raise AssertionError(f"{pdf_path}: {backend} found {len(pages)} pages, pdfplumber {len(reference)}")
+            for expected, actual in zip(reference, pages):
+                for field in ('text', 'page_type'):
+                    if getattr(expected, field) != getattr(actual, field):
+                        raise AssertionError(f"{pdf_path} page {expected.index}: {backend} {field} differs: "
+                                             f"{getattr(actual, field)!r} != {getattr(expected, field)!r}")
+                if bool(expected.image_count) != bool(actual.image_count):
+                    raise AssertionError(f"{pdf_path} page {expected.index}: {backend} image presence differs")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            probes = pdf_to_excel.probe_pages(str(pdf_path))
+            seconds['probe'] = round(time.perf_counter() - start, 4)
+
+        documents.append({
+            'pdf': str(pdf_path),
+            'pages': len(reference),
+            'probe_type_mismatches': [record.index for record, probe in zip(reference, probes)
+                                      if record.page_type != probe.page_type],
+            'seconds': seconds,
+            'speedup': {backend: round(seconds['pdfplumber'] / max(value, 1e-9), 2)
+                        for backend, value in seconds.items()},
+        })
+    return {'documents': documents}
+
+
+SYNTHETIC_QUESTIONS = [
+    "A {age}-year-old patient presents to the Emergency Department with {complaint}. Observations are\n"
+    "heart rate {hr} beats per minute, blood pressure {sbp}/{dbp} and oxygen saturation {sat}% on room air.\n"
+    "Which of the following is the most appropriate next step in management?",
+    "A {age}-year-old is brought in by ambulance after {complaint}. On arrival the heart rate is {hr}\n"
+    "and blood pressure is {sbp}/{dbp}. What is the most likely diagnosis?",
+]
+SYNTHETIC_COMPLAINTS = ["sudden onset chest pain", "a fall from standing height", "shortness of breath",
+                        "a seizure lasting ten minutes", "abdominal pain and vomiting", "a road traffic collision"]
+
+
+def generate_synthetic_pdf(path: str, pages: int, image_every: int = 5, seed: int = 0) -> int:
+    """
+    Write a question bank PDF with the same page structure as the real
+    banks: question page (options + category key), optional image page,
+    answer page and explanation page. Returns the number of questions
+    """
+    import random
+
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    keys = list(pdf_to_excel.CATEGORY_MAP)
+    width, height = 1440, 810
+
+    # A handful of distinct figures, reused like logos/diagrams in real banks
+    figures = []
+    for shade in range(4):
+        pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 96, 96), False)
+        pixmap.clear_with(40 + shade * 50)
+        figures.append(pixmap.tobytes("png"))
+
+    def write_lines(page, lines, y=60, size=20):
+        for line in lines:
+            page.insert_text((60, y), line, fontsize=size)
+            y += size * 1.5
+
+    doc = fitz.open()
+    questions = 0
+    while doc.page_count < pages:
+        number = questions + 1
+        text = rng.choice(SYNTHETIC_QUESTIONS).format(
+            age=rng.randint(1, 95), complaint=rng.choice(SYNTHETIC_COMPLAINTS), hr=rng.randint(40, 180),
+            sbp=rng.randint(70, 190), dbp=rng.randint(40, 110), sat=rng.randint(80, 100))
+        options = [f"Management option {number}-{letter} " + rng.choice(SYNTHETIC_COMPLAINTS) for letter in "ABCDE"]
+        correct = rng.randrange(len(options))
+
+        page = doc.new_page(width=width, height=height)
+        write_lines(page, text.split("\n") + [f"{letter}. {option}" for letter, option in zip("ABCDE", options)])
+        page.insert_text((60, height - 40), rng.choice(keys).title(), fontsize=14)
+
+        if image_every and number % image_every == 0:
+            page = doc.new_page(width=width, height=height)
+            page.insert_image(fitz.Rect(400, 100, 1000, 700), stream=rng.choice(figures))
+
+        page = doc.new_page(width=width, height=height)
+        write_lines(page, [f"{'ABCDE'[correct]}. {options[correct]}"])
+
+        page = doc.new_page(width=width, height=height)
+        write_lines(page, [f"Explanation for question {number}: option {'ABCDE'[correct]} is correct because",
+                           "it addresses the immediate threat to life before any further investigation."])
+        questions += 1
+
+    doc.save(path)
+    doc.close()
+    return questions
+
+
+def synthetic_question_dicts(count: int, seed: int = 0) -> List[Dict]:
+    """Extracted questions in the legacy dict layout, sized like the real banks'"""
+    import random
+
+    rng = random.Random(seed)
+    categories = list(pdf_to_excel.CATEGORY_MAP.values())
+    questions = []
+    for number in range(1, count + 1):
+        text = rng.choice(SYNTHETIC_QUESTIONS).format(
+            age=rng.randint(1, 95), complaint=rng.choice(SYNTHETIC_COMPLAINTS), hr=rng.randint(40, 180),
+            sbp=rng.randint(70, 190), dbp=rng.randint(40, 110), sat=rng.randint(80, 100)).replace("\n", " ")
+        q = {'Question': text}
+        for letter in "ABCDE":
+            q[f'Option{letter}'] = f"Management option {number}-{letter} " + rng.choice(SYNTHETIC_COMPLAINTS)
+        q['CorrectAnswer'] = rng.choice("ABCDE")
+        q['AnswerConfidence'] = 1.0
+        q['Category'] = rng.choice(categories)
+        q['Explanation'] = f"Explanation for question {number}: " + " ".join(
+            rng.choice(SYNTHETIC_COMPLAINTS) for _ in range(60))
+        q['QuestionImage'] = f"extracted_images/page_{number * 4}.png" if number % 5 == 0 else 'null'
+        q['ExplanationImage'] = 'null'
+        questions.append(q)
+    return questions
+
+
+def legacy_format_question(q: Dict) -> Dict:
+    """format_question as it was when questions were dicts"""
+    choices = {letter: q[f'Option{letter}'] for letter in "ABCDE" if q[f'Option{letter}']}
+    return {
+        "question_text": q['Question'],
+        "choices": choices,
+        "correct_answer": q['CorrectAnswer'],
+        "answer_confidence": q.get('AnswerConfidence'),
+        "category": q['Category'],
+        "explanation": q['Explanation'],
+        "image_url": q['QuestionImage'] if q['QuestionImage'] != 'null' else None,
+        "explanation_image_url": q['ExplanationImage'] if q['ExplanationImage'] != 'null' else None,
+    }
+
+
+def legacy_write_json(questions: List[Dict], f):
+    """The JSON array writer as it was: json.dumps(indent=2) per question"""
+    for index, q in enumerate(questions):
+        f.write('[\n' if index == 0 else ',\n')
+        f.write('  ' + json.dumps(legacy_format_question(q), indent=2, ensure_ascii=False).replace('\n', '\n  '))
+    f.write('\n]' if questions else '[]')
+
+
+def synthetic_bank(count: int, seed: int = 0) -> List:
+    """Varied QuestionRecords: text drawn from a large pseudo-word vocabulary, so unrelated questions share little"""
+    import random
+
+    rng = random.Random(seed)
+    syllables = ["ka", "ro", "mi", "te", "lu", "sa", "no", "pe", "di", "vo", "ga", "re", "tu", "fi", "ha", "zo"]
+    vocabulary = sorted({''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(30000)})
+    categories = list(pdf_to_excel.CATEGORY_MAP.values())
+    return [pdf_to_excel.QuestionRecord(
+        ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(20, 35))),
+        tuple(' '.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 5))) for _ in "ABCDE"),
+        category=rng.choice(categories),
+    ) for _ in range(count)]
+
+
+def bench_dedupe(corpus: int = 200000, upload: int = 5000, seed: int = 0) -> Dict:
+    """
+    Duplicate index benchmark: index a synthetic corpus, then check an
+    upload of exact copies, one-word edits and new questions against it.
+    Reports throughput and how many planted duplicates were found
+    """
+    import random
+
+    rng = random.Random(seed)
+    bank = synthetic_bank(corpus + upload, seed)
+    existing, fresh = bank[:corpus], bank[corpus:]
+
+    # A tenth exact copies, a tenth one-word edits, the rest new
+    planted = {}
+    questions = []
+    for number, q in enumerate(fresh):
+        if number % 10 == 0:
+            source = rng.choice(existing)
+            q = pdf_to_excel.QuestionRecord(source.question, source.options, category=source.category)
+            planted[id(q)] = pdf_to_excel.DUPLICATE_EXACT
+        elif number % 10 == 1:
+            source = rng.choice(existing)
+            words = source.question.split()
+            words[rng.randrange(len(words))] = "edited"
+            q = pdf_to_excel.QuestionRecord(' '.join(words), source.options, category=source.category)
+            planted[id(q)] = pdf_to_excel.DUPLICATE_NEAR
+        questions.append(q)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        index_path = os.path.join(work_dir, "dedupe.sqlite")
+        index = pdf_to_excel.DuplicateIndex(index_path)
+        start = time.perf_counter()
+        for chunk in range(0, corpus, 10000):  # One upload-sized commit at a time
+            for q in existing[chunk:chunk + 10000]:
+                index.check(q)
+            index.commit()
+        build_seconds = time.perf_counter() - start
+        index_mb = os.path.getsize(index_path) / 2**20
+
+        index.counts = dict.fromkeys(index.counts, 0)
+        start = time.perf_counter()
+        for q in questions:
+            index.check(q)
+        index.commit()
+        check_seconds = time.perf_counter() - start
+        index.close()
+
+    found = {status: sum(1 for q in questions if planted.get(id(q)) == status and q.duplicate[1] == status)
+             for status in (pdf_to_excel.DUPLICATE_EXACT, pdf_to_excel.DUPLICATE_NEAR)}
+    false_positives = sum(1 for q in questions
+                          if id(q) not in planted and q.duplicate[1] != pdf_to_excel.DUPLICATE_NEW)
+    return {
+        'corpus': corpus,
+        'upload': upload,
+        'build_seconds': round(build_seconds, 2),
+        'index_mb': round(index_mb, 1),
+        'check_seconds': round(check_seconds, 2),
+        'questions_per_second': round(upload / check_seconds),
+        'counts': index.counts,
+        'planted': {status: sum(1 for value in planted.values() if value == status) for status in found},
+        'found': found,
+        'false_positives': false_positives,
+    }
+
+
+# Strings COPY output has to escape or quote, used for its round-trip check
+COPY_HARD_TEXTS = [
+    "tab\there", "line\nbreak", "windows\r\nline", "back\\slash", "\\N", "\\.", "ends with \\",
+    'say "hi", then "bye"', '""', ",", "nul\0byte", "ünïcødé — 😀", "",
+]
+
+COPY_TEXT_ESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r', 't': '\t'}
+COPY_CSV_FIELD_RE = re.compile(r'"([^"]*(?:""[^"]*)*)"|(?=[,\n])')
+
+
+def read_copy(path: str, fmt: str) -> List[tuple]:
+    """
+    Rows of a pgcopy/pgcsv file, decoded the way PostgreSQL's COPY FROM does
+    (None for NULL); written independently of the writers it checks
+    """
+    with open(path, 'rb') as f:
+        data = f.read().decode('utf-8')
+
+    rows = []
+    if fmt == 'pgcopy':
+        for line in data.split('\n')[:-1]:
+            if '\r' in line:
+                raise AssertionError("pgcopy row has a literal carriage return, COPY rejects it")
+            rows.append(tuple(None if field == '\\N' else
+                              re.sub(r'\\(.)', lambda m: COPY_TEXT_ESCAPES[m.group(1)], field)
+                              for field in line.split('\t')))
+        return rows
+
+    position, row = 0, []
+    while position < len(data):
+        match = COPY_CSV_FIELD_RE.match(data, position)
+        row.append(None if match.group(1) is None else match.group(1).replace('""', '"'))
+        position = match.end() + 1
+        if data[match.end()] == '\n':
+            rows.append(tuple(row))
+            row = []
+    return rows
+
+
+def expected_copy_rows(questions: List[Dict], plan_level: str) -> List[tuple]:
+    """What read_copy should give back for questions in the legacy dict layout"""
+    def clean(value):
+        return value.replace('\0', '') if isinstance(value, str) else value
+
+    rows = []
+    for q in map(legacy_format_question, questions):
+        rows.append((clean(q['question_text']), {letter: clean(text) for letter, text in q['choices'].items()},
+                     clean(q['correct_answer']), clean(q['category']), plan_level, clean(q['explanation']),
+                     clean(q['image_url']), clean(q['explanation_image_url'])))
+    return rows
+
+
+def check_copy_round_trip(questions: List[Dict], work_dir: str):
+    """Write questions in both COPY formats and fail unless they read back unchanged"""
+    store = pdf_to_excel.QuestionStore(map(pdf_to_excel.QuestionRecord.from_dict, questions))
+    expected = expected_copy_rows(questions, 'Primary')
+    for fmt in pdf_to_excel.COPY_FORMATS:
+        path = os.path.join(work_dir, f"round_trip.{fmt}")
+        pdf_to_excel.write_questions(store, path, fmt, plan_level='Primary')
+        rows = [row[:1] + (json.loads(row[1]),) + row[2:] for row in read_copy(path, fmt)]
+        if rows != expected:
+            raise AssertionError(f"{fmt} output does not read back as the questions written")
+
+
+def copy_hard_questions() -> List[Dict]:
+    """Questions in the legacy dict layout whose every text field is one of COPY_HARD_TEXTS"""
+    questions = synthetic_question_dicts(len(COPY_HARD_TEXTS))
+    for q, text in zip(questions, COPY_HARD_TEXTS):
+        for key in ('Question', 'OptionA', 'OptionE', 'Category', 'Explanation'):
+            q[key] = text
+        q['QuestionImage'] = text or 'null'
+    return questions
+
+
+def bench_shards(count: int = 20000, sample: int = 50, seed: int = 0) -> Dict:
+    """
+    Category shard build, incremental rebuild and sampling benchmark: builds
+    shards for a synthetic bank, rebuilds them after changing one category,
+    and reads random samples from the largest shard; fails unless every
+    question (and every sample) reads back as written, only the changed
+    category's shard is rewritten, and a partial upload replaces only its
+    own categories (all but those with prune)
+    """
+    import gzip
+    import random
+
+    # Synthetic image paths name no real file; shard them as published URLs
+    questions = [pdf_to_excel.QuestionRecord.from_dict(q).map_images(
+                     lambda image: f"https://images.example/{image.rsplit('/', 1)[-1]}")
+                 for q in synthetic_question_dicts(count, seed)]
+    raw = b''.join(json.dumps(q.output(), ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                   for q in questions)
+
+    def build(work_dir: str, records, prune: bool = False) -> tuple:
+        start = time.perf_counter()
+        builder = pdf_to_excel.ShardBuilder(work_dir, prune=prune)
+        for q in records:
+            builder.add(q)
+        stats = builder.build()
+        return time.perf_counter() - start, stats
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        projection = pdf_to_excel.ShardBuilder(work_dir)
+        expected: Dict[str, List[Dict]] = {}
+        for q in questions:
+            expected.setdefault(q.category or pdf_to_excel.SHARD_UNCATEGORIZED, []).append(
+                projection.serving_output(q))
+        build_seconds, stats = build(work_dir, questions)
+        with open(os.path.join(work_dir, pdf_to_excel.SHARD_MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        for category, entries in expected.items():
+            if pdf_to_excel.read_shard_questions(work_dir, category) != entries:
+                raise AssertionError(f"{category} shard does not read back as the questions written")
+
+        unchanged_seconds, unchanged = build(work_dir, questions)
+        if unchanged['written']:
+            raise AssertionError("Rebuilding unchanged questions rewrote shards")
+
+        changed_category = questions[0].category
+        edited = [q.copy() for q in questions]
+        for q in edited:
+            if q.category == changed_category:
+                q.explanation += " (revised)"
+        rebuild_seconds, rebuilt = build(work_dir, edited)
+        if rebuilt != {'written': 1, 'kept': len(expected) - 1, 'removed': 1}:
+            raise AssertionError(f"Changing one category rebuilt {rebuilt}")
+
+        partial = [q for q in edited if q.category == changed_category]
+        _, partial_stats = build(work_dir, partial)
+        if partial_stats != {'written': 0, 'kept': len(expected), 'removed': 0}:
+            raise AssertionError(f"A one-category upload rebuilt {partial_stats}")
+        for category, entries in expected.items():
+            if category != changed_category and pdf_to_excel.read_shard_questions(work_dir, category) != entries:
+                raise AssertionError(f"A one-category upload changed the {category} shard")
+
+        rng = random.Random(seed)
+        largest = max(expected, key=lambda category: len(expected[category]))
+        indices = rng.sample(range(len(expected[largest])), min(sample, len(expected[largest])))
+        start = time.perf_counter()
+        sampled = pdf_to_excel.read_shard_questions(work_dir, largest, indices)
+        sample_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        whole = pdf_to_excel.read_shard_questions(work_dir, largest)
+        whole_seconds = time.perf_counter() - start
+        if sampled != [whole[index] for index in sorted(indices)]:
+            raise AssertionError("Sampled questions differ from the same questions read from the whole shard")
+
+        _, pruned = build(work_dir, partial, prune=True)
+        if pruned != {'written': 0, 'kept': 1, 'removed': len(expected) - 1}:
+            raise AssertionError(f"Pruning to a one-category upload gave {pruned}")
+
+    shard_bytes = sum(entry['bytes'] for entry in manifest['categories'].values())
+    return {
+        'questions': count,
+        'categories': len(expected),
+        'compression': manifest['categories'][largest]['compression'],
+        'raw_mb': round(len(raw) / 2**20, 2),
+        'shards_mb': round(shard_bytes / 2**20, 2),
+        'compression_ratio': round(len(raw) / shard_bytes, 2),
+        'single_stream_ratio': round(len(raw) / len(gzip.compress(raw, compresslevel=9, mtime=0)), 2),
+        'build_seconds': round(build_seconds, 3),
+        'unchanged_rebuild_seconds': round(unchanged_seconds, 3),
+        'one_category_rebuild_seconds': round(rebuild_seconds, 3),
+        'one_category_rebuild': rebuilt,
+        'one_category_upload': partial_stats,
+        'one_category_prune': pruned,
+        'largest_shard_questions': len(expected[largest]),
+        'sample': len(indices),
+        'sample_ms': round(sample_seconds * 1000, 2),
+        'whole_shard_ms': round(whole_seconds * 1000, 2),
+    }
+
+
+def traced_bytes(build: Callable):
+    """(result, bytes still allocated by build once it returns)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = build()
+        return value, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def bench_records(count: int = 10000, repeat: int = 3) -> Dict:
+    """
+    Question representation benchmark: per-question memory of legacy dicts,
+    QuestionRecords and a QuestionStore (text strings excluded, they are
+    shared by all three), and serialization time and traced peak memory of
+    the legacy JSON writer vs write_questions in every output format; fails
+    if the outputs differ, or if the COPY formats don't read back unchanged
+    """
+    legacy = synthetic_question_dicts(count)
+
+    _, dict_bytes = traced_bytes(lambda: [dict(q) for q in legacy])
+    records, record_bytes = traced_bytes(lambda: [pdf_to_excel.QuestionRecord.from_dict(q) for q in legacy])
+    store, store_bytes = traced_bytes(lambda: pdf_to_excel.QuestionStore(records))
+
+    def best_of(func) -> float:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        legacy_path = os.path.join(work_dir, "legacy.json")
+        outputs = {fmt: os.path.join(work_dir, f"questions.{fmt}") for fmt in pdf_to_excel.OUTPUT_WRITERS}
+
+        def write_legacy():
+            with open(legacy_path, 'w', encoding='utf-8') as f:
+                legacy_write_json(legacy, f)
+
+        seconds = {'legacy_json': best_of(write_legacy)}
+        peak_mb = {}
+        for fmt, path in outputs.items():
+            options = {'plan_level': 'Primary'} if fmt in pdf_to_excel.COPY_FORMATS else {}
+            seconds[fmt] = best_of(lambda: pdf_to_excel.write_questions(store, path, fmt, **options))
+            # Fed from a generator, as in --stream mode
+            tracemalloc.start()
+            pdf_to_excel.write_questions(iter(store), path, fmt, **options)
+            peak_mb[fmt] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+
+        with open(legacy_path, encoding='utf-8') as f:
+            expected = f.read()
+        with open(outputs['json'], encoding='utf-8') as f:
+            if f.read() != expected:
+                raise AssertionError("write_questions JSON output differs from the legacy writer")
+        with open(outputs['jsonl'], encoding='utf-8') as f:
+            if [json.loads(line) for line in f] != json.loads(expected):
+                raise AssertionError("write_questions JSON Lines output differs from the legacy writer")
+        workbook = openpyxl.load_workbook(outputs['xlsx'], read_only=True)
+        rows = workbook['Questions'].iter_rows(min_row=2, values_only=True)
+        if [row[0] for row in rows] != [q['Question'] for q in legacy]:
+            raise AssertionError("Excel output rows differ from the questions written")
+        workbook.close()
+        check_copy_round_trip(legacy, work_dir)
+        check_copy_round_trip(copy_hard_questions(), work_dir)
+
+    return {
+        'questions': count,
+        'bytes_per_question': {
+            'dict': round(dict_bytes / count),
+            'record': round(record_bytes / count),
+            'store': round(store_bytes / count),
+        },
+        'seconds': {name: round(value, 4) for name, value in seconds.items()},
+        'questions_per_second': {name: round(count / value) for name, value in seconds.items()},
+        'write_peak_mb': peak_mb,
+        'json_speedup': round(seconds['legacy_json'] / seconds['json'], 2),
+    }
+
+
+def measure(stage: str, func: Callable, results: Dict, trace_memory: bool):
+    """Run one stage, recording wall time and (optionally) traced peak memory"""
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - start
+    results[stage] = {'seconds': round(elapsed, 4)}
+    if trace_memory:
+        results[stage]['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+    return value
+
+
+def run_stages(pdf_path: str, work_dir: str, trace_memory: bool) -> Dict:
+    """
+    Run the serial pipeline one stage at a time
+    Returns per-stage results plus the written output path
+    """
+    stages: Dict[str, Dict] = {}
+    image_dir = os.path.join(work_dir, "extracted_images")
+    output_path = os.path.join(work_dir, "questions_output.json")
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pdf = measure('page_load', lambda: pdfplumber.open(pdf_path), stages, trace_memory)
+            pages = pdf.pages
+            cache = pdf_to_excel.PageCache(pages)
+            measure('detect_page_type', lambda: [cache[i].page_type for i in range(len(cache))],
+                    stages, trace_memory)
+            groups = measure('group_question_pages', lambda: pdf_to_excel.group_question_pages(cache),
+                             stages, trace_memory)
+            images = measure('image_extraction', lambda: pdf_to_excel.extract_images_batch(
+                pdf_path, pdf_to_excel.collect_image_pages(groups, cache), image_dir), stages, trace_memory)
+            questions = measure('extract_complete_question', lambda: [
+                pdf_to_excel.extract_complete_question(pdf_path, cache, group, images) for group in groups
+            ], stages, trace_memory)
+            measure('generate_json', lambda: pdf_to_excel.generate_json(questions, output_path),
+                    stages, trace_memory)
+            pdf.close()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return {'pages': len(pages), 'questions': len(questions), 'stages': stages, 'output_path': output_path}
+
+
+def run_mode(pdf_path: str, work_dir: str, options: List[str]) -> float:
+    """End-to-end wall time of one CLI mode (e.g. --stream, --parallel)"""
+    output_path = os.path.join(work_dir, "mode_output.json")
+    args = pdf_to_excel.parse_args([str(pdf_path), output_path, '--no-cache'] + options)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pdf_to_excel.run_extraction(args)
+    return time.perf_counter() - start
+
+
+def check_probe_cache(pdf_path: str, work_dir: str) -> Dict:
+    """
+    Run --probe, then a full extraction twice against one extraction cache;
+    fails if the full run reuses the probe result or the repeat misses
+    """
+    output_path = os.path.join(work_dir, "cache_output.json")
+    cache_dir = os.path.join(work_dir, "cache")
+    hits = []
+    for options in (['--probe'], [], []):
+        args = pdf_to_excel.parse_args([str(pdf_path), output_path, '--cache-dir', cache_dir] + options)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            pdf_to_excel.run_extraction(args)
+        hits.append("Cache hit" in log.getvalue())
+
+    if hits[1]:
+        raise AssertionError("A full extraction reused the cached --probe result")
+    if not hits[2]:
+        raise AssertionError("A repeated full extraction missed the extraction cache")
+    return {'probe_then_full_hit': hits[1], 'repeat_hit': hits[2]}
+
+
+# Output fields holding an image path (or a list of them)
+IMAGE_FIELDS = ('image_url', 'explanation_image_url', 'image_urls', 'explanation_image_urls')
+
+
+def map_output_images(question: Dict, func: Callable) -> Dict:
+    """Copy of an output question with func applied to every image path"""
+    question = dict(question)
+    for field in IMAGE_FIELDS:
+        value = question.get(field)
+        if isinstance(value, list):
+            question[field] = [func(image) for image in value]
+        elif value:
+            question[field] = func(value)
+    return question
+
+
+def bench_publish(pdf_paths) -> Dict:
+    """
+    --publish end to end against an in-process HTTP PUT stub: extracts each
+    PDF once locally and once publishing through HttpPutUploader; fails
+    unless the published output is the local one with every image replaced
+    by the URL of its content-hash object, and every object was PUT once
+    with the image's bytes and content type
+    """
+    import hashlib
+    import http.server
+    import shutil
+    import threading
+    import urllib.parse
+
+    objects: Dict[str, tuple] = {}
+    puts = []
+    lock = threading.Lock()
+
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def do_PUT(self):
+            data = self.rfile.read(int(self.headers['Content-Length']))
+            with lock:
+                puts.append(self.path)
+                objects[self.path] = (data, self.headers['Content-Type'])
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/images"
+
+    def run(pdf_path, output_path: str, job_id: str, options: List[str]) -> tuple:
+        args = pdf_to_excel.parse_args([str(pdf_path), output_path, '--no-cache', '--job-id', job_id] + options)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pdf_to_excel.run_extraction(args)
+        seconds = time.perf_counter() - start
+        with open(output_path, encoding='utf-8') as f:
+            return json.load(f), seconds
+
+    def published_url(image: str) -> str:
+        suffix = Path(image).suffix.lower()
+        digest = hashlib.sha256((SCRIPT_DIR / image).read_bytes()).hexdigest()[:32]
+        return f"{endpoint}/{digest}{suffix}"
+
+    documents = []
+    try:
+        for pdf_path in pdf_paths:
+            with tempfile.TemporaryDirectory() as work_dir:
+                local_job, publish_job = 'bench-publish-local', 'bench-publish'
+                try:
+                    local, local_seconds = run(pdf_path, os.path.join(work_dir, "local.json"), local_job, [])
+                    del puts[:]
+                    published, publish_seconds = run(pdf_path, os.path.join(work_dir, "published.json"),
+                                                     publish_job, ['--publish', endpoint])
+                    expected = [map_output_images(q, published_url) for q in local]
+                finally:
+                    for job_id in (local_job, publish_job):
+                        shutil.rmtree(SCRIPT_DIR / pdf_to_excel.job_output_dir(job_id), ignore_errors=True)
+
+            if published != expected:
+                raise AssertionError(f"{pdf_path}: published output differs from the local output with URLs")
+            paths = set()
+            for q in published:
+                for field in IMAGE_FIELDS:
+                    value = q.get(field)
+                    urls = value if isinstance(value, list) else [value] if value else []
+                    paths.update(urllib.parse.urlsplit(url).path for url in urls)
+            if sorted(puts) != sorted(paths):
+                raise AssertionError(f"{pdf_path}: expected one PUT per image object, got {len(puts)} "
+                                     f"for {len(paths)} objects")
+            for path in paths:
+                data, content_type = objects[path]
+                if hashlib.sha256(data).hexdigest()[:32] != Path(path).stem:
+                    raise AssertionError(f"{pdf_path}: {path} was uploaded with other bytes")
+                if content_type != pdf_to_excel.IMAGE_CONTENT_TYPES.get(Path(path).suffix.lower()):
+                    raise AssertionError(f"{pdf_path}: {path} was uploaded as {content_type}")
+
+            documents.append({
+                'pdf': str(pdf_path),
+                'questions': len(published),
+                'objects': len(paths),
+                'uploaded_kb': round(sum(len(objects[path][0]) for path in paths) / 1024, 1),
+                'local_seconds': round(local_seconds, 3),
+                'publish_seconds': round(publish_seconds, 3),
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {'endpoint': endpoint, 'documents': documents}
+
+
+def compare_golden(output_path: str, golden_path: Path, image_dir: str) -> Dict:
+    """
+    Compare extracted questions with the stored golden file, field by field
+    Only fields present in both the output and the golden file are compared
+    """
+    with open(output_path, encoding='utf-8') as f:
+        actual = json.load(f)
+    with open(golden_path, encoding='utf-8') as f:
+        expected = json.load(f)
+
+    mismatches = []
+    for index in range(max(len(actual), len(expected))):
+        if index >= len(actual) or index >= len(expected):
+            mismatches.append({'index': index, 'field': '<missing question>'})
+            continue
+        for field, value in actual[index].items():
+            if isinstance(value, str) and value.startswith(image_dir):
+                value = "extracted_images" + value[len(image_dir):]
+            if field not in expected[index]:
+                continue  # Field added after the golden file was made
+            if expected[index].get(field) != value:
+                mismatches.append({'index': index, 'field': field})
+
+    return {'golden_file': str(golden_path), 'match': not mismatches,
+            'questions': len(expected), 'mismatches': mismatches[:20]}
+
+
+def bench_pipeline(pdf_paths, trace_memory: bool = True, modes: Optional[List[str]] = None) -> Dict:
+    """
+    Benchmark every PDF: per-stage time (and memory in a separate traced
+    run, so tracing doesn't skew the timings), pages/sec, other CLI modes
+    end to end, a golden-file comparison where one is stored, and a check
+    that --probe results are cached apart from full extractions
+    """
+    documents = []
+    for pdf_path in pdf_paths:
+        pdf_path = Path(pdf_path)
+        with tempfile.TemporaryDirectory() as work_dir:
+            run = run_stages(str(pdf_path), work_dir, trace_memory=False)
+            total = sum(stage['seconds'] for stage in run['stages'].values())
+            result = {
+                'pdf': str(pdf_path),
+                'size_bytes': pdf_path.stat().st_size,
+                'pages': run['pages'],
+                'questions': run['questions'],
+                'total_seconds': round(total, 4),
+                'pages_per_second': round(run['pages'] / total, 2) if total else None,
+                'stages': run['stages'],
+            }
+
+            golden = GOLDEN_FILES.get(pdf_path.name)
+            if golden is not None and golden.exists():
+                result['golden'] = compare_golden(run['output_path'], golden,
+                                                  os.path.join(work_dir, "extracted_images"))
+
+            result['probe_cache'] = check_probe_cache(pdf_path, work_dir)
+
+            if trace_memory:
+                traced = run_stages(str(pdf_path), work_dir, trace_memory=True)
+                for stage, values in traced['stages'].items():
+                    result['stages'][stage]['peak_mb'] = values['peak_mb']
+
+            if modes:
+                result['modes'] = {mode: round(run_mode(pdf_path, work_dir, mode.split()), 4) for mode in modes}
+        documents.append(result)
+
+    try:
+        import resource
+        max_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:  # Windows
+        max_rss_mb = None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'extractor_version': pdf_to_excel.EXTRACTOR_VERSION,
+        'max_rss_mb': max_rss_mb,
+        'documents': documents,
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = commands.add_parser('pipeline', help="Per-stage time/memory benchmark with golden-file check")
+    pipeline.add_argument('pdfs', nargs='*', default=SAMPLE_PDFS)
+    pipeline.add_argument('--synthetic-pages', type=int, action='append', default=[],
+                          help="Also benchmark a generated bank of this many pages (repeatable)")
+    pipeline.add_argument('--no-memory', action='store_true', help="Skip the traced-memory run")
+    pipeline.add_argument('--mode', action='append', dest='modes', default=[],
+                          help='Also time a CLI mode end to end, e.g. --mode=--stream --mode="--parallel --workers 4"')
+    pipeline.add_argument('--output', help="Write results JSON here instead of stdout")
+
+    synth = commands.add_parser('synth', help="Generate a synthetic question bank PDF")
+    synth.add_argument('path')
+    synth.add_argument('--pages', type=int, default=1000)
+    synth.add_argument('--image-every', type=int, default=5, help="Add an image page every N questions")
+    synth.add_argument('--seed', type=int, default=0)
+
+    tokenizer = commands.add_parser('tokenizer', help="Page tokenizer micro-benchmark and equivalence check")
+    tokenizer.add_argument('pdfs', nargs='*', default=SAMPLE_PDFS)
+    tokenizer.add_argument('--repeat', type=int, default=50)
+
+    backends = commands.add_parser('backends', help="Text backend equivalence check and timing")
+    backends.add_argument('pdfs', nargs='*', default=SAMPLE_PDFS)
+
+    records = commands.add_parser('records', help="Question record memory and serialization benchmark")
+    records.add_argument('--questions', type=int, default=10000)
+    records.add_argument('--repeat', type=int, default=3)
+
+    dedupe = commands.add_parser('dedupe', help="Duplicate index build and lookup benchmark")
+    dedupe.add_argument('--corpus', type=int, default=200000, help="Questions indexed before the upload")
+    dedupe.add_argument('--upload', type=int, default=5000, help="Questions checked against the corpus")
+
+    shards = commands.add_parser('shards', help="Category shard build, incremental rebuild and sampling benchmark")
+    shards.add_argument('--questions', type=int, default=20000)
+    shards.add_argument('--sample', type=int, default=50, help="Questions sampled from the largest shard")
+
+    publish = commands.add_parser('publish', help="--publish end to end against a local HTTP PUT stub")
+    publish.add_argument('pdfs', nargs='*', default=SAMPLE_PDFS)
+
+    args = parser.parse_args(argv)
+    if args.command == 'synth':
+        count = generate_synthetic_pdf(args.path, args.pages, args.image_every, args.seed)
+        print(f"Wrote {args.path}: {args.pages}+ pages, {count} questions")
+        return
+
+    if args.command == 'tokenizer':
+        result = bench_tokenizer(args.pdfs, args.repeat)
+    elif args.command == 'backends':
+        result = compare_backends(args.pdfs)
+    elif args.command == 'records':
+        result = bench_records(args.questions, args.repeat)
+    elif args.command == 'dedupe':
+        result = bench_dedupe(args.corpus, args.upload)
+    elif args.command == 'shards':
+        result = bench_shards(args.questions, args.sample)
+    elif args.command == 'publish':
+        result = bench_publish(args.pdfs)
+    else:
+        with tempfile.TemporaryDirectory() as synth_dir:
+            pdfs = list(args.pdfs)
+            for pages in args.synthetic_pages:
+                path = os.path.join(synth_dir, f"synthetic_{pages}.pdf")
+                generate_synthetic_pdf(path, pages)
+                pdfs.append(path)
+            result = bench_pipeline(pdfs, trace_memory=not args.no_memory, modes=args.modes)
+
+    if getattr(args, 'output', None):
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved: {args.output}")
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
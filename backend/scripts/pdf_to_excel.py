@@ -6,416 +6,2865 @@ Extracts questions, options, images, and explanations from structured PDFs
 import pdfplumber
 import openpyxl
 from pathlib import Path
+import contextlib
+import itertools
+import json
 import re
-from typing import Dict, List, Optional
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
 from openpyxl.worksheet.datavalidation import DataValidation
 
-def extract_pages(pdf_path: str) -> List[pdfplumber.page.Page]:
+class Instrumentation:
+    """
+    Per-stage timers, per-page parse timings, page type counts and image bytes
+    Progress events are written as JSON Lines to a separate stream (if one
+    is configured) so callers can follow a run live without parsing stdout
+    """
+    # Upper bounds (seconds) of the per-page timing histogram buckets
+    PAGE_TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self, stream=None):
+        self.reset(stream)
+
+    def reset(self, stream=None):
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.page_types: Dict[str, int] = {}
+        self.page_seconds: List[tuple] = []  # (seconds, page index)
+        self.pages_cached = 0
+        self.images_written = 0
+        self.images_deduplicated = 0
+        self.image_bytes = 0
+        self.questions = 0
+
+    def emit(self, event: str, **fields):
+        if self.stream is None:
+            return
+        message = {'event': event, 'elapsed': round(time.perf_counter() - self.started, 4)}
+        message.update(fields)
+        self.stream.write(json.dumps(message, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        self.emit('stage_start', stage=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.emit('stage_end', stage=name, seconds=round(seconds, 4))
+
+    def page_done(self, record: 'PageInfo', cached: bool = False):
+        self.page_types[record.page_type] = self.page_types.get(record.page_type, 0) + 1
+        if cached:
+            self.pages_cached += 1
+        else:
+            self.page_seconds.append((record.parse_seconds, record.index))
+        self.emit('page', index=record.index, type=record.page_type,
+                  seconds=round(record.parse_seconds, 4), cached=cached)
+
+    def document_cached(self, page_count: int):
+        """Whole-document cache hit: every page counts as cached"""
+        self.pages_cached += page_count
+
+    def image_written(self, size: int):
+        self.images_written += 1
+        self.image_bytes += size
+
+    def image_deduplicated(self):
+        self.images_deduplicated += 1
+
+    def question_done(self):
+        self.questions += 1
+        self.emit('question', count=self.questions)
+
+    def summary(self) -> Dict:
+        histogram = {f"<{bound}s": 0 for bound in self.PAGE_TIME_BUCKETS}
+        histogram[f">={self.PAGE_TIME_BUCKETS[-1]}s"] = 0
+        for seconds, _ in self.page_seconds:
+            for bound in self.PAGE_TIME_BUCKETS:
+                if seconds < bound:
+                    histogram[f"<{bound}s"] += 1
+                    break
+            else:
+                histogram[f">={self.PAGE_TIME_BUCKETS[-1]}s"] += 1
+
+        slowest = sorted(self.page_seconds, reverse=True)[:10]
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            'page_types': self.page_types,
+            'pages_parsed': len(self.page_seconds),
+            'pages_cached': self.pages_cached,
+            'page_time_histogram': histogram,
+            'slowest_pages': [{'index': index, 'seconds': round(seconds, 4)} for seconds, index in slowest],
+            'images_written': self.images_written,
+            'images_deduplicated': self.images_deduplicated,
+            'image_bytes': self.image_bytes,
+            'questions': self.questions,
+        }
+
+    def finish(self) -> Dict:
+        summary = self.summary()
+        self.emit('done', **summary)
+        return summary
+
+
+# Module-wide instrumentation; run_extraction points it at the job's progress stream
+instrumentation = Instrumentation()
+
+
+def open_progress_stream(dest: str):
+    """
+    Progress event destination: '-' for stderr, 'fd:N' for an inherited
+    file descriptor (e.g. an extra pipe from the backend), else a file path
+    """
+    import os
+    import sys
+
+    if dest == '-':
+        return sys.stderr
+    if dest.startswith('fd:'):
+        return os.fdopen(int(dest[3:]), 'w', encoding='utf-8', buffering=1, closefd=False)
+    return open(dest, 'w', encoding='utf-8', buffering=1)
+
+
+class PyMuPDFPage:
+    """
+    pdfplumber-compatible view of a PyMuPDF page
+    Implements just what analyze_page needs: extract_text() reproduces
+    pdfplumber's default (non-layout) text, images has one entry per image
+    placement on the page
+    """
+    # pdfplumber's default word/line tolerances
+    X_TOLERANCE = 3
+    Y_TOLERANCE = 3
+
+    def __init__(self, document: 'PyMuPDFDocument', index: int):
+        self.document = document
+        self.page_number = index + 1
+
+    @property
+    def images(self) -> List[Dict]:
+        return self.document.doc[self.page_number - 1].get_image_info()
+
+    def words(self) -> List[tuple]:
+        """
+        (x0, top, text) per word, split the way pdfplumber splits them:
+        on whitespace and on horizontal gaps wider than X_TOLERANCE
+        """
+        import fitz  # PyMuPDF
+
+        page = self.document.doc[self.page_number - 1]
+        descents = self.document.font_descents(page)
+        flags = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP  # Expand ligatures like pdfplumber
+        words = []
+        for block in page.get_text('rawdict', flags=flags)['blocks']:
+            for line in block.get('lines', ()):
+                word = None
+                last_x1 = None
+                for span in line['spans']:
+                    size = span['size']
+                    descent = descents.get(span['font'], span['descender'])
+                    for char in span['chars']:
+                        x0, _, x1, _ = char['bbox']
+                        if char['c'].isspace():
+                            word = None
+                        else:
+                            # pdfminer's glyph box: baseline minus (1 + descent) font sizes
+                            top = char['origin'][1] - size * (1 + descent)
+                            if word is None or x0 > last_x1 + self.X_TOLERANCE:
+                                word = [x0, top, []]
+                                words.append(word)
+                            word[1] = min(word[1], top)
+                            word[2].append(char['c'])
+                        last_x1 = x1
+        return [(x0, top, ''.join(chars)) for x0, top, chars in words]
+
+    def extract_text(self) -> str:
+        return join_word_lines(self.words(), self.Y_TOLERANCE)
+
+    def close(self):
+        pass
+
+    def flush_cache(self):
+        pass
+
+
+def join_word_lines(words: Iterable[tuple], tolerance: float = 3) -> str:
+    """
+    Page text from (x0, top, text) words, the way pdfplumber lays it out:
+    words are clustered into lines by top coordinate (each word within
+    tolerance of the previous one), top to bottom, words left to right
+    """
+    lines = []
+    last_top = None
+    for word in sorted(words, key=lambda word: word[1]):
+        if lines and word[1] <= last_top + tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+        last_top = word[1]
+    return '\n'.join(' '.join(word[2] for word in sorted(line, key=lambda word: word[0])) for line in lines)
+
+
+class PyMuPDFDocument:
+    """
+    PyMuPDF document exposing a pdfplumber-like .pages list
+    Text comes from MuPDF's C text extraction instead of pdfminer's
+    pure-Python layout analysis, several times faster on our banks
+    """
+
+    def __init__(self, pdf_path: str):
+        import fitz  # PyMuPDF
+
+        self.doc = fitz.open(pdf_path)
+        self.pages = [PyMuPDFPage(self, index) for index in range(self.doc.page_count)]
+        self._descents: Dict[int, Optional[float]] = {}
+
+    def __enter__(self) -> 'PyMuPDFDocument':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.doc.close()
+
+    def font_descents(self, page) -> Dict[str, float]:
+        """
+        Font name -> descent (fraction of font size) from the font descriptor,
+        which is what pdfminer sizes glyph boxes with; MuPDF's own descender
+        comes from the embedded font program and can differ. Fonts without
+        a descriptor (standard 14, Type 3) are left to the span's descender
+        """
+        descents = {}
+        for xref, _, font_type, basefont, *_ in page.get_fonts():
+            if xref not in self._descents:
+                self._descents[xref] = self._descriptor_descent(xref, font_type)
+            if self._descents[xref] is not None:
+                descents[basefont.split('+', 1)[-1]] = self._descents[xref]  # Strip subset prefix
+        return descents
+
+    def _descriptor_descent(self, xref: int, font_type: str) -> Optional[float]:
+        if font_type == 'Type0':
+            # CID fonts keep their descriptor on the descendant font
+            kind, value = self.doc.xref_get_key(xref, 'DescendantFonts')
+            match = re.search(r'(\d+) 0 R', value)
+            if kind not in ('array', 'xref') or not match:
+                return None
+            xref = int(match.group(1))
+        kind, value = self.doc.xref_get_key(xref, 'FontDescriptor')
+        if kind != 'xref':
+            return None
+        kind, value = self.doc.xref_get_key(int(value.split()[0]), 'Descent')
+        if kind not in ('int', 'float'):
+            return None
+        return -abs(float(value)) / 1000  # Some producers write it positive
+
+
+# Text extraction backends for --backend; both yield the same page text
+TEXT_BACKENDS = {
+    'pdfplumber': pdfplumber.open,
+    'pymupdf': PyMuPDFDocument,
+}
+
+
+def open_pdf(pdf_path: str, backend: str = 'pdfplumber'):
+    """Open a PDF with the chosen text backend; the result has .pages and closes as a context manager"""
+    return TEXT_BACKENDS[backend](pdf_path)
+
+
+def document_page_count(pdf) -> int:
+    """Page count of an open document without building its page list"""
+    if isinstance(pdf, PyMuPDFDocument):
+        return pdf.doc.page_count
+    from pdfminer.pdftypes import resolve1
+
+    try:
+        return int(resolve1(resolve1(pdf.doc.catalog['Pages'])['Count']))
+    except Exception:
+        return len(pdf.pages)  # Malformed page tree: let pdfplumber walk it
+
+
+def seek_page_tree(document, start: int) -> Iterator:
+    """
+    pdfminer PDFPages from index start on, found by descending the page
+    tree: subtrees wholly before start are skipped by their /Count and leaf
+    kids (/Type /Page) are counted off without being built, so no page
+    before start is parsed
+    Follows PDFPage.create_pages otherwise (attribute inheritance, cycle
+    guard); page labels are not read
+    """
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdftypes import dict_value, list_value, resolve1
+    from pdfminer.psparser import LIT
+
+    pages_type, page_type = LIT('Pages'), LIT('Page')
+    skip = start
+    visited = set()
+
+    def search(obj, parent):
+        nonlocal skip
+        properties = dict_value(obj).copy()
+        if obj.objid in visited:
+            return
+        visited.add(obj.objid)
+        for key, value in parent.items():
+            if key in PDFPage.INHERITABLE_ATTRS and key not in properties:
+                properties[key] = value
+
+        object_type = properties.get('Type', properties.get('type'))
+        if object_type is pages_type and 'Kids' in properties:
+            kids = list_value(properties['Kids'])
+            count = resolve1(properties.get('Count'))
+            if isinstance(count, int) and skip >= count:
+                skip -= count
+                return
+            for child in kids:
+                if skip and getattr(child, 'objid', None) is not None:
+                    kid = dict_value(child)
+                    if kid.get('Type', kid.get('type')) is page_type:
+                        # Leaf page before start: count it off without building it
+                        if child.objid not in visited:
+                            visited.add(child.objid)
+                            skip -= 1
+                        continue
+                yield from search(child, properties)
+        elif object_type is page_type:
+            if skip:
+                skip -= 1
+            else:
+                yield obj.objid, properties
+
+    for objid, properties in search(document.catalog['Pages'], document.catalog):
+        yield PDFPage(document, objid, properties, None)
+
+
+def iter_pdf_pages(pdf, start: int = 0) -> Iterator:
+    """
+    Pages of an open document from index start on, created one at a time
+    pdfplumber's .pages builds a Page for every page up front, which alone
+    takes seconds on a large bank; this walks pdfminer's page tree lazily
+    and seeks past the pages before start without building them. Their
+    height is then missing from doctop, which only shifts a page's coordinates
+    """
+    if isinstance(pdf, PyMuPDFDocument):
+        yield from pdf.pages[start:]
+        return
+    from pdfminer.pdfpage import PDFPage
+
+    pages = enumerate(PDFPage.create_pages(pdf.doc))
+    if start > 0 and 'Pages' in pdf.doc.catalog:
+        seek = seek_page_tree(pdf.doc, start)
+        try:
+            first = next(seek, None)
+        except Exception:
+            first = None  # Malformed page tree: walk it the slow way
+        if first is not None:
+            pages = enumerate(itertools.chain([first], seek), start)
+
+    doctop = 0
+    for index, page in pages:
+        if index >= start:
+            page = pdfplumber.page.Page(pdf, page, page_number=index + 1, initial_doctop=doctop)
+            doctop += page.height
+            yield page
+
+
+def close_pdf(pdf):
+    """
+    Close a document opened for iter_pdf_pages
+    pdfplumber's close() builds a Page for every page just to close it,
+    so only its file is closed here; the pages were closed as they went
+    """
+    if isinstance(pdf, PyMuPDFDocument):
+        pdf.close()
+    elif not pdf.stream_is_external:
+        pdf.stream.close()
+
+
+def extract_pages(pdf_path: str, backend: str = 'pdfplumber') -> List[pdfplumber.page.Page]:
     """
     Extract all pages from pdf
     Returns list of page objects
+    Raises if the PDF cannot be opened or has no pages, so a job fails
+    instead of writing an empty output
     """
     try:
-        pdf = pdfplumber.open(pdf_path)
+        pdf = open_pdf(pdf_path, backend)
         pages = pdf.pages
-        print(f"Loaded PDF:{len(pages)}pages found")
-        return pages
     except Exception as e:
         print(f"Error loading PDF: {e}")
-        return []
+        raise
+    print(f"Loaded PDF:{len(pages)}pages found")
+    if not pages:
+        raise ValueError(f"No pages found in {pdf_path}")
+    return pages
+
+
+def iter_pages(pdf_path: str, page_store: Optional['PageStore'] = None,
+               backend: str = 'pdfplumber', start: int = 0) -> Iterator['PageInfo']:
+    """
+    Lazily analyze pages one at a time (streaming mode), from index start on
+    Each page's parsed layout is released as soon as its PageInfo is built,
+    so memory doesn't grow with the number of pages
+    Pages found in page_store are not parsed at all
+    Raises like extract_pages if the PDF cannot be opened or has no pages
+    """
+    try:
+        pdf = open_pdf(pdf_path, backend)
+    except Exception as e:
+        print(f"Error loading PDF: {e}")
+        raise
+
+    try:
+        page_count = document_page_count(pdf)
+        print(f"Loaded PDF:{page_count}pages found")
+        if not page_count:
+            raise ValueError(f"No pages found in {pdf_path}")
+        for page in iter_pdf_pages(pdf, start):
+            record = lookup_or_analyze_page(page, page.page_number - 1, page_store)
+            page.close()
+            yield record
+    finally:
+        close_pdf(pdf)
+
+
+# Precompiled line patterns for the page tokenizer
+OPTION_MARKER_RE = re.compile(r'^[A-Ea-e][\.\)]')  # A., a., A), a)
+OPTION_RE = re.compile(r'^([A-Ea-e])[\.\)]\s*(.+)')
+CATEGORY_KEY_RE = re.compile(r'^[A-Z][a-z]$|^[A-Z]{2}$')  # Ca, Ma, RE, EN, ...
+
+# Line kinds assigned by tokenize_page
+LINE_BODY = 'body'
+LINE_OPTION = 'option'
+LINE_CATEGORY_KEY = 'category_key'
+LINE_NOISE = 'noise'  # Empty or too short to be content (headers, page numbers)
+
+
+class PageModel:
+    """
+    Tokenized page text
+    lines are the stripped lines of text.strip(), each classified once in kinds;
+    options, the category key and the raw option-marker count are collected
+    in the same pass so the extractors never re-split or re-match the text
+    """
+    __slots__ = ('lines', 'kinds', 'options', 'raw_option_count',
+                 'category_key', 'has_category_key', 'text_length')
+
+
+def tokenize_page(text: str) -> PageModel:
+    """
+    Single pass over a page's lines using the precompiled patterns
+    """
+    model = PageModel()
+    lines = []
+    kinds = []
+    options = {}
+    raw_option_count = 0
+
+    for raw_line in text.split('\n'):
+        line = raw_line.strip()
+
+        if OPTION_MARKER_RE.match(line):
+            kind = LINE_OPTION
+            match = OPTION_RE.match(line)
+            if match:
+                options[match.group(1).upper()] = match.group(2).strip()
+        elif CATEGORY_KEY_RE.match(line):
+            kind = LINE_CATEGORY_KEY
+        elif len(line) <= 3:
+            kind = LINE_NOISE
+        else:
+            kind = LINE_BODY
+
+        # Page type detection counts markers on the unstripped line; that only
+        # differs from the stripped result when the line has leading whitespace
+        if raw_line[:1].isspace():
+            raw_option_count += bool(OPTION_MARKER_RE.match(raw_line))
+        else:
+            raw_option_count += kind == LINE_OPTION
+
+        lines.append(line)
+        kinds.append(kind)
+
+    # Match text.strip().split('\n'): drop blank lines at either end
+    start, end = 0, len(lines)
+    while start < end and not lines[start]:
+        start += 1
+    while end > start and not lines[end - 1]:
+        end -= 1
+    if start == end:
+        lines, kinds = [''], [LINE_NOISE]
+    else:
+        lines, kinds = lines[start:end], kinds[start:end]
+
+    model.lines = lines
+    model.kinds = kinds
+    model.options = options
+    model.raw_option_count = raw_option_count
+    model.text_length = len(text.strip())
+
+    # Category key is at the bottom, look from end
+    model.category_key = ""
+    for line, kind in zip(reversed(lines), reversed(kinds)):
+        if kind == LINE_CATEGORY_KEY:
+            model.category_key = line
+            break
+
+    # Upper-case key (e.g. "RE") within the last 3 lines
+    model.has_category_key = any(kind == LINE_CATEGORY_KEY and line[1].isupper()
+                                 for line, kind in zip(lines[-3:], kinds[-3:]))
+    return model
+
 
+def as_page_model(page_text) -> PageModel:
+    """Tokenize page text, or pass an existing PageModel through"""
+    return page_text if isinstance(page_text, PageModel) else tokenize_page(page_text)
 
-def extract_question(page_text: str) -> str:
+
+def extract_question(page_text) -> str:
     """
     Extract question text from page
     Question is the first text block before options
+    Accepts page text or a PageModel
     """
-    lines = page_text.strip().split('\n')
+    model = as_page_model(page_text)
     question_lines = []
 
-    for line in lines:
-        line = line.strip()
+    for line, kind in zip(model.lines, model.kinds):
         # Stop when we hit options (A., a., A), a) etc.)
-        if re.match(r'^[A-Ea-e][\.\)]', line):
+        if kind == LINE_OPTION:
             break
         # Skip empty lines and header/footer
-        if line and len(line) > 3:
+        if len(line) > 3:
             question_lines.append(line)
 
     #Join and clean
     question = ' '.join(question_lines)
     return question.strip()
 
-def extract_options(page_text: str) -> Dict[str, str]:
+def extract_options(page_text) -> Dict[str, str]:
     """
     Extract multiple choice options from page
     Handles formats: A., a., A), a)
+    Accepts page text or a PageModel
     """
-    options = {}
-    lines = page_text.strip().split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        # Match A., a., A), a) at start of line
-        match = re.match(r'^([A-Ea-e])[\.\)]\s*(.+)', line)
-        if match:
-            letter = match.group(1).upper()  # Convert to uppercase
-            text = match.group(2).strip()
-            options[letter] = text
-    
-    return options
+    return dict(as_page_model(page_text).options)
 
-def extract_and_save_images(pdf_path: str, page_num: int, output_dir: str = "extracted_images") -> Optional[str]:
-    """
-    Extract and save images from PDF page using PyMuPDF
-    """
-    import fitz  # PyMuPDF
-    from pathlib import Path
+def _image_output_dir(output_dir: str) -> str:
+    """Make output_dir absolute relative to script location"""
     import os
-    
-    # Make output_dir absolute relative to script location
+
     script_dir = os.path.dirname(os.path.abspath(__file__))
     abs_output_dir = os.path.join(script_dir, output_dir)
-    Path(abs_output_dir).mkdir(exist_ok=True)
-    
+    Path(abs_output_dir).mkdir(parents=True, exist_ok=True)
+    return abs_output_dir
+
+
+# Image directory relative to the script; jobs (--job-id) get a subdirectory each
+IMAGE_ROOT = "extracted_images"
+# Workspaces of --batch documents; their outputs keep referencing the images,
+# so cleanup_workspaces leaves them alone
+BATCH_JOB_PREFIX = "batch-"
+JOB_ID_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$')
+
+
+def job_output_dir(job_id: Optional[str] = None) -> str:
+    """
+    Image directory for a job, relative to the script
+    Without a job id images go straight into IMAGE_ROOT (single-run layout)
+    """
+    if job_id is None:
+        return IMAGE_ROOT
+    if not JOB_ID_RE.match(job_id):
+        raise ValueError(f"Invalid job id {job_id!r}: use letters, digits, '_', '-' and '.'")
+    return f"{IMAGE_ROOT}/{job_id}"
+
+
+def cleanup_workspaces(ttl_seconds: float) -> int:
+    """
+    Remove job workspaces nobody has written to for ttl_seconds
+    Catches jobs whose caller crashed before cleaning up; returns how many were removed
+    Batch workspaces (BATCH_JOB_PREFIX) are kept until removed by hand
+    """
+    import shutil
+
+    root = Path(_image_output_dir(IMAGE_ROOT))
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    for workspace in root.iterdir():
+        try:
+            if workspace.name.startswith(BATCH_JOB_PREFIX):
+                continue
+            if workspace.is_dir() and workspace.stat().st_mtime < cutoff:
+                shutil.rmtree(workspace)
+                removed += 1
+        except OSError:
+            pass  # Removed by a concurrent cleanup
+    return removed
+
+
+def atomic_write(path, data: bytes):
+    """Write through a temp file in the same directory and rename it into place,
+    so concurrent readers never see a partially written file; the temp name
+    carries the thread id too, as uploads write from asyncio.to_thread workers"""
+    import os
+    import threading
+
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        doc = fitz.open(pdf_path)
-        page = doc[page_num]
-        image_list = page.get_images()
-        
-        if image_list:
-            # Get first image
-            xref = image_list[0][0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            
-            # Save image with absolute path
-            img_filename = f"page_{page_num}.png"
-            img_path = os.path.join(abs_output_dir, img_filename)
-            with open(img_path, "wb") as img_file:
-                img_file.write(image_bytes)
-            
-            doc.close()
-            # Return relative path for JSON (backend will construct absolute path)
-            return f"{output_dir}/{img_filename}"
-    except Exception as e:
-        print(f"Warning: Could not extract image from page {page_num}: {e}")
-    
-    return None
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def rebase_images(q: 'QuestionRecord', output_dir: str) -> 'QuestionRecord':
+    """Point a question's image paths at output_dir (file names are kept)"""
+    return q.map_images(lambda image: f"{output_dir}/{image.rsplit('/', 1)[-1]}")
+
+
+# PyMuPDF image format -> file extension for formats browsers display as is;
+# anything else (JBIG2, JPEG 2000, TIFF, ...) is converted to PNG
+WEB_IMAGE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'jpg': 'jpg', 'gif': 'gif', 'webp': 'webp'}
+
+# Re-encoding targets for --image-format ('original' keeps the source format)
+IMAGE_FORMATS = {'original': None, 'png': 'PNG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+
+class ImageOptions:
+    """
+    How extracted images are encoded and deduplicated
+    Re-encoding, resizing and perceptual hashing need Pillow; without it
+    images are written in their (web-safe) source format
+    """
+    __slots__ = ('format', 'max_dimension', 'quality', 'all_images', 'dedupe_distance', 'content_names')
+
+    def __init__(self, format: str = 'original', max_dimension: Optional[int] = None, quality: int = 85,
+                 all_images: bool = False, dedupe_distance: Optional[int] = None, content_names: bool = False):
+        self.format = format
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.all_images = all_images
+        self.dedupe_distance = dedupe_distance
+        # Name files by content hash instead of page_N (job workspaces)
+        self.content_names = content_names
+
+    @classmethod
+    def from_args(cls, args) -> 'ImageOptions':
+        return cls(args.image_format, args.max_image_dimension, args.image_quality,
+                   args.all_images, args.dedupe_distance, content_names=args.job_id is not None)
+
+    def cache_salt(self) -> str:
+        """Options that change the output, for extraction cache keys"""
+        return repr(tuple(getattr(self, name) for name in self.__slots__))
+
+
+_PIL_IMAGE = None
+
+
+def _pillow():
+    """PIL.Image, or None (with a warning, once) if Pillow is not installed"""
+    global _PIL_IMAGE
+    if _PIL_IMAGE is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            print("Warning: Pillow is not installed, images are kept in their source format and size")
+            Image = False
+        _PIL_IMAGE = Image
+    return _PIL_IMAGE or None
+
+
+def difference_hash(image) -> int:
+    """
+    64-bit perceptual dHash: compare neighbouring pixels of a 9x8 grayscale
+    thumbnail. Re-encoded, rescaled or slightly retouched copies of a
+    figure land within a few bits of each other
+    """
+    Image = _pillow()
+    pixels = image.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+class ImageExtractor:
+    """
+    Extracts and saves page images using PyMuPDF
+    The document is opened once and kept open across calls. Images are
+    written in their real format (or re-encoded per ImageOptions), and
+    duplicates share one file: the same xref, identical bytes or, with
+    dedupe_distance set, a perceptual hash within that many bits
+    """
+
+    def __init__(self, pdf_path: str, output_dir: str = "extracted_images",
+                 options: Optional[ImageOptions] = None):
+        import fitz  # PyMuPDF
+
+        self.output_dir = output_dir
+        self.abs_output_dir = _image_output_dir(output_dir)
+        self.options = options or ImageOptions()
+        self.saved_xrefs: Dict[int, str] = {}
+        self.saved_digests: Dict[str, str] = {}
+        self.saved_hashes: List[tuple] = []  # (dHash, path)
+        try:
+            self.doc = fitz.open(pdf_path)
+        except Exception as e:
+            print(f"Warning: Could not open {pdf_path} for image extraction: {e}")
+            self.doc = None
+
+    def __enter__(self) -> 'ImageExtractor':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+
+    def extract(self, page_nums) -> Dict[int, List[str]]:
+        """
+        Returns {page_num: [relative image paths]} for pages that have images
+        Only the first image of a page unless options.all_images is set
+        """
+        saved: Dict[int, List[str]] = {}
+        if self.doc is None:
+            return saved
+
+        for page_num in sorted(set(page_nums)):
+            try:
+                image_list = self.doc[page_num].get_images()
+                if not self.options.all_images:
+                    image_list = image_list[:1]
+                paths = [self.save(page_num, position, image[0]) for position, image in enumerate(image_list)]
+                if paths:
+                    saved[page_num] = paths
+            except Exception as e:
+                print(f"Warning: Could not extract image from page {page_num}: {e}")
+
+        return saved
+
+    def save(self, page_num: int, position: int, xref: int) -> str:
+        """Write one image (unless a duplicate exists) and return its relative path"""
+        import hashlib
+        import os
+
+        if xref in self.saved_xrefs:
+            return self.saved_xrefs[xref]
+
+        base_image = self.doc.extract_image(xref)
+        source_digest = hashlib.sha256(base_image["image"]).hexdigest()
+        if source_digest in self.saved_digests:
+            path = self.saved_digests[source_digest]
+        else:
+            image_bytes, extension, image_hash = self.encode(xref, base_image)
+            digest = hashlib.sha256(image_bytes).hexdigest()
+            path = self.saved_digests.get(digest) or self.find_similar(image_hash)
+            if path is None:
+                # Return relative path for JSON (backend will construct absolute path)
+                if self.options.content_names:
+                    img_filename = f"{digest[:32]}.{extension}"
+                elif position == 0:
+                    img_filename = f"page_{page_num}.{extension}"
+                else:
+                    img_filename = f"page_{page_num}_{position}.{extension}"
+                atomic_write(os.path.join(self.abs_output_dir, img_filename), image_bytes)
+                instrumentation.image_written(len(image_bytes))
+                path = f"{self.output_dir}/{img_filename}"
+                self.saved_digests[digest] = path
+                if image_hash is not None:
+                    self.saved_hashes.append((image_hash, path))
+            else:
+                instrumentation.image_deduplicated()
+            self.saved_digests[source_digest] = path
+
+        self.saved_xrefs[xref] = path
+        return path
+
+    def find_similar(self, image_hash: Optional[int]) -> Optional[str]:
+        if image_hash is None:
+            return None
+        for saved_hash, path in self.saved_hashes:
+            if bin(saved_hash ^ image_hash).count('1') <= self.options.dedupe_distance:
+                return path
+        return None
+
+    def encode(self, xref: int, base_image: Dict) -> tuple:
+        """
+        Final (bytes, file extension, perceptual hash or None) for an image
+        Source bytes are kept whenever no conversion or resize is needed
+        """
+        import io
+
+        options = self.options
+        image_bytes = base_image["image"]
+        extension = WEB_IMAGE_EXTENSIONS.get(base_image["ext"])
+        target = IMAGE_FORMATS[options.format]
+        too_large = options.max_dimension is not None and \
+            max(base_image["width"], base_image["height"]) > options.max_dimension
+        needs_pillow = target is not None or too_large or options.dedupe_distance is not None
+
+        Image = _pillow() if needs_pillow else None
+        if extension is None:
+            image_bytes, extension = self.pixmap_png(xref), 'png'
+        if Image is None:
+            return image_bytes, extension, None
+
+        image = Image.open(io.BytesIO(image_bytes))
+        image_hash = difference_hash(image) if options.dedupe_distance is not None else None
+        if target is None and not too_large:
+            return image_bytes, extension, image_hash
+
+        if target is None:
+            target = 'JPEG' if extension == 'jpg' else image.format or 'PNG'
+        if too_large:
+            image.thumbnail((options.max_dimension, options.max_dimension), Image.LANCZOS)
+        if target == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            image = image.convert('RGBA')
+
+        out = io.BytesIO()
+        if target in ('JPEG', 'WEBP'):
+            image.save(out, target, quality=options.quality)
+        else:
+            image.save(out, target, optimize=True)
+        return out.getvalue(), {'JPEG': 'jpg'}.get(target, target.lower()), image_hash
+
+    def pixmap_png(self, xref: int) -> bytes:
+        """Render an image browsers can't display (JBIG2, JPX, CMYK, ...) to PNG"""
+        import fitz  # PyMuPDF
 
-def extract_explanation(page_text: str) -> str:
+        pixmap = fitz.Pixmap(self.doc, xref)
+        if pixmap.colorspace is not None and pixmap.colorspace.n > 3:
+            pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+        return pixmap.tobytes('png')
+
+
+def extract_images_batch(pdf_path: str, page_nums, output_dir: str = "extracted_images",
+                         options: Optional[ImageOptions] = None) -> Dict[int, List[str]]:
+    """
+    Extract the images of every requested page in one pass over the document
+    Returns {page_num: [relative image paths]}
+    """
+    with ImageExtractor(pdf_path, output_dir, options) as extractor:
+        return extractor.extract(page_nums)
+
+
+def extract_and_save_images(pdf_path: str, page_num: int, output_dir: str = "extracted_images") -> Optional[str]:
+    """
+    Extract and save images from a single PDF page using PyMuPDF
+    Prefer extract_images_batch when handling more than one page
+    """
+    return (extract_images_batch(pdf_path, [page_num], output_dir).get(page_num) or [None])[0]
+
+
+def collect_image_pages(question_groups: List[Dict], pages) -> List[int]:
+    """
+    Page indices whose images are needed by the given question groups
+    Question image pages always; explanation pages only if they contain images
+    """
+    pages = as_page_cache(pages)
+    page_nums = []
+    for group in question_groups:
+        if group['image_page'] is not None:
+            page_nums.append(group['image_page'])
+        if group['explanation_page'] is not None and pages[group['explanation_page']].image_count > 0:
+            page_nums.append(group['explanation_page'])
+    return page_nums
+
+def extract_explanation(page_text) -> str:
     """
     Extract explanation text from page
     Explanation usually appears after the repeated question section
+    Accepts page text or a PageModel
     """
-    lines = page_text.strip().split('\n')
+    model = as_page_model(page_text)
     explanation_lines = []
     found_second_question = False
-    
+
     # Look for repeated question (after options)
     option_count = 0
-    for i, line in enumerate(lines):
-        line = line.strip()
-        
+    for line, kind in zip(model.lines, model.kinds):
+        # Upper-case "A." style options only
+        is_option = kind == LINE_OPTION and line[0] in 'ABCDE' and line[1] == '.'
+
         # Count options to find where they end
-        if re.match(r'^[A-E]\.', line):
+        if is_option:
             option_count += 1
-        
+
         # After we've seen options twice (8 or 10 lines), start collecting explanation
         if option_count >= 8:  # 4 options × 2 = 8 (or 5 × 2 = 10)
             found_second_question = True
-        
-        # Collect text after second set of options
-        if found_second_question and line and len(line) > 3:
-            # Skip option lines
-            if not re.match(r'^[A-E]\.', line):
-                explanation_lines.append(line)
-    
+
+        # Collect text after second set of options, skipping option lines
+        if found_second_question and len(line) > 3 and not is_option:
+            explanation_lines.append(line)
+
     explanation = ' '.join(explanation_lines)
     return explanation.strip()
 
 
-def detect_page_type(page) -> str:
+class PageInfo:
     """
-    Detect what type of page this is:
-    - 'question': Has question + options (A-E)
-    - 'image': Mostly image, little text
-    - 'answer': Short text with answer (e.g., "C. Emergency thoracotomy")
-    - 'explanation': Text after answer page
+    Compact per-page analysis record
+    Holds everything the classifiers/extractors need so a page is
+    only run through pdfplumber's layout analysis once
     """
-    text = page.extract_text()
-    
-    # Count text length
-    text_length = len(text.strip())
-    
-    # Count options (full option list A-E or a-e)
-    option_matches = re.findall(r'^[A-Ea-e][\.\)]', text, re.MULTILINE)
-    option_count = len(option_matches)
-    
-    # Check if text starts with a single option (answer page pattern)
-    lines = text.strip().split('\n')
-    first_line = lines[0].strip() if lines else ""
-    is_single_answer = re.match(r'^[A-Ea-e][\.\)]', first_line) and option_count == 1
-    
-    # Check for category key at bottom (2 uppercase letters)
-    has_category_key = False
-    for line in reversed(lines[-3:]):  # Check last 3 lines
-        if re.match(r'^[A-Z]{2}$', line.strip()):
-            has_category_key = True
-            break
-    
-    # Check for images
-    has_images = len(page.images) > 0
-    
-    # Decision logic
-    if is_single_answer:
-        # Short text starting with single option = answer page
-        return 'answer'
-    elif has_category_key and option_count >= 4:
-        # Has category key and multiple options = question page
-        return 'question'
-    elif option_count >= 4 and text_length > 100:
-        # Has multiple options and substantial text = question page
-        return 'question'
-    elif has_images and text_length < 50:
-        # Mostly image, little text
-        return 'image'
-    elif text_length > 50:
-        # Text without options
-        return 'explanation'
-    else:
-        return 'unknown'
+    __slots__ = ('index', 'text', 'image_count', 'model', 'option_count',
+                 'has_category_key', 'category_key', 'page_type', 'parse_seconds')
 
-def group_question_pages(pages) -> List[Dict]:
+    def __init__(self, index: int, text: str, image_count: int, parse_seconds: float = 0.0):
+        self.index = index
+        self.text = text
+        self.image_count = image_count
+        self.parse_seconds = parse_seconds
+        self.model = tokenize_page(text)
+
+        # Count options (full option list A-E or a-e)
+        self.option_count = self.model.raw_option_count
+
+        # Check for category key at bottom (2 uppercase letters)
+        self.has_category_key = self.model.has_category_key
+
+        self.category_key = self.model.category_key
+        self.page_type = classify_page(self)
+
+
+def analyze_page(page, index: int) -> PageInfo:
     """
-    Group pages into complete questions
-    Returns list of dicts with page indices for each question component
+    Run the expensive text/image calls for a page exactly once
     """
-    questions = []
-    i = 0
-    
-    while i < len(pages):
-        page_type = detect_page_type(pages[i])
-        
+    start = time.perf_counter()
+    text = page.extract_text() or ''
+    image_count = len(page.images)
+    return PageInfo(index, text, image_count, time.perf_counter() - start)
+
+
+def lookup_or_analyze_page(page, index: int, page_store: Optional['PageStore'] = None) -> PageInfo:
+    """
+    Reuse a stored analysis for an unchanged page, otherwise analyze and store it
+    """
+    record = page_store.lookup(index) if page_store is not None else None
+    cached = record is not None
+    if not cached:
+        record = analyze_page(page, index)
+        if page_store is not None:
+            page_store.save(record)
+    instrumentation.page_done(record, cached)
+    return record
+
+
+def probe_pages(pdf_path: str) -> List[PageInfo]:
+    """
+    Cheap classification-only pass over every page (--probe)
+    Lines come from MuPDF's word boxes without pdfplumber's glyph metrics,
+    which is close enough for detect_page_type but not for extraction:
+    extract_questions re-analyzes the pages that end up in a question
+    """
+    import fitz  # PyMuPDF
+
+    records = []
+    with fitz.open(pdf_path) as doc:
+        for index, page in enumerate(doc):
+            start = time.perf_counter()
+            words = [(x0, top, text) for x0, top, _, _, text, *_ in page.get_text('words')]
+            text = join_word_lines(words, PyMuPDFPage.Y_TOLERANCE)
+            records.append(PageInfo(index, text, len(page.get_image_info()), time.perf_counter() - start))
+    return records
+
+
+def pages_needing_text(question_groups: List[Dict]) -> List[int]:
+    """Pages the extractors read text from: question, answer and explanation pages"""
+    return sorted({group[key] for group in question_groups
+                   for key in ('question_page', 'answer_page', 'explanation_page')
+                   if group[key] is not None})
+
+
+class PageCache:
+    """
+    Lazily analyzed pages, keyed by page index
+    Tracks hits/misses so we can verify each page is parsed once
+    """
+
+    def __init__(self, pages, page_store: Optional['PageStore'] = None):
+        self.pages = pages
+        self.page_count = len(pages)
+        self.page_store = page_store
+        self.records: Dict[int, PageInfo] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_records(cls, records: List[PageInfo]) -> 'PageCache':
+        """Build a cache from records analyzed elsewhere (e.g. worker processes)"""
+        cache = cls([])
+        cache.page_count = len(records)
+        cache.records = {record.index: record for record in records}
+        cache.misses = len(records)
+        return cache
+
+    def __len__(self) -> int:
+        return self.page_count
+
+    def __getitem__(self, index: int) -> PageInfo:
+        record = self.records.get(index)
+        if record is not None:
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = lookup_or_analyze_page(self.pages[index], index, self.page_store)
+        self.records[index] = record
+        return record
+
+    def add(self, record: PageInfo):
+        """Store a record analyzed elsewhere (e.g. by iter_pages)"""
+        self.records[record.index] = record
+        self.page_count = max(self.page_count, record.index + 1)
+        self.misses += 1
+
+    def evict_through(self, index: int):
+        """Drop records up to and including index (streaming mode)"""
+        for key in [key for key in self.records if key <= index]:
+            del self.records[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'pages': len(self.records)}
+
+
+def _analyze_page_list(pdf_path: str, indices: List[int], backend: str = 'pdfplumber') -> List[PageInfo]:
+    """
+    Worker entry point for parallel mode
+    Opens the PDF in this process and analyzes the given pages
+    Pages are opened by range (iter_pdf_pages seeks to the chunk's first
+    page), so a chunk never builds page objects for the rest of the document
+    """
+    records = []
+    wanted = set(indices)
+    last = max(wanted, default=-1)
+    pdf = open_pdf(pdf_path, backend)
+    try:
+        for page in iter_pdf_pages(pdf, min(wanted, default=0)):
+            index = page.page_number - 1
+            if index > last:
+                break
+            if index in wanted:
+                records.append(analyze_page(page, index))
+            page.close()  # Drop parsed layout, we only keep the record
+    finally:
+        close_pdf(pdf)
+    return records
+
+
+def analyze_pages_parallel(pdf_path: str, page_count: int, workers: int,
+                           page_store: Optional['PageStore'] = None, backend: str = 'pdfplumber',
+                           indices: Optional[Iterable[int]] = None) -> PageCache:
+    """
+    Analyze all pages (or just indices) across a process pool
+    Pages are split into contiguous slices (a few per worker to balance
+    uneven pages); results are stitched back in page order so
+    group_question_pages sees exactly what the serial path would
+    Pages already in page_store are not sent to the workers
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    records = []
+    missing = []
+    for index in (range(page_count) if indices is None else indices):
+        record = page_store.lookup(index) if page_store is not None else None
+        if record is None:
+            missing.append(index)
+        else:
+            records.append(record)
+            instrumentation.page_done(record, cached=True)
+
+    if missing:
+        workers = max(1, min(workers, len(missing)))
+        chunk_size = max(1, -(-len(missing) // (workers * 4)))
+        chunks = [missing[start:start + chunk_size] for start in range(0, len(missing), chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_analyze_page_list, pdf_path, chunk, backend) for chunk in chunks]
+            for future in futures:
+                for record in future.result():
+                    records.append(record)
+                    instrumentation.page_done(record)
+                    if page_store is not None:
+                        page_store.save(record)
+
+    records.sort(key=lambda record: record.index)
+    return PageCache.from_records(records)
+
+
+def as_page_cache(pages) -> PageCache:
+    """Wrap a plain list of pdfplumber pages, or pass an existing cache through"""
+    return pages if isinstance(pages, PageCache) else PageCache(pages)
+
+
+def detect_page_type(page) -> str:
+    """
+    Detect what type of page this is:
+    - 'question': Has question + options (A-E)
+    - 'image': Mostly image, little text
+    - 'answer': Short text with answer (e.g., "C. Emergency thoracotomy")
+    - 'explanation': Text after answer page
+    Accepts a pdfplumber page or an already analyzed PageInfo
+    """
+    if isinstance(page, PageInfo):
+        return page.page_type
+    return analyze_page(page, page.page_number - 1).page_type
+
+
+def classify_page(info: PageInfo) -> str:
+    """
+    Page type decision logic, see detect_page_type
+    """
+    # Count text length
+    text_length = info.model.text_length
+
+    # Check if text starts with a single option (answer page pattern)
+    is_single_answer = info.model.kinds[0] == LINE_OPTION and info.option_count == 1
+
+    # Check for images
+    has_images = info.image_count > 0
+
+    # Decision logic
+    if is_single_answer:
+        # Short text starting with single option = answer page
+        return 'answer'
+    elif info.has_category_key and info.option_count >= 4:
+        # Has category key and multiple options = question page
+        return 'question'
+    elif info.option_count >= 4 and text_length > 100:
+        # Has multiple options and substantial text = question page
+        return 'question'
+    elif has_images and text_length < 50:
+        # Mostly image, little text
+        return 'image'
+    elif text_length > 50:
+        # Text without options
+        return 'explanation'
+    else:
+        return 'unknown'
+
+def iter_question_groups(records: Iterable[PageInfo]) -> Iterator[Dict]:
+    """
+    Group analyzed pages into complete questions
+    Consumes PageInfo records in page order and yields a dict of page
+    indices for each question as soon as its last page has been seen
+    """
+    records = iter(records)
+    pending = next(records, None)
+
+    while pending is not None:
+        record, pending = pending, next(records, None)
+        page_type = record.page_type
+
         # Skip intro/cover pages
-        if page_type == 'image' and i < 3:
-            i += 1
+        if page_type == 'image' and record.index < 3:
             continue
-        
+
         # Start of a question
         if page_type == 'question':
             question_group = {
-                'question_page': i,
+                'question_page': record.index,
                 'image_page': None,
                 'answer_page': None,
                 'explanation_page': None
             }
-            
-            i += 1
-            
+
             # Check next pages
-            while i < len(pages):
-                next_type = detect_page_type(pages[i])
-                
+            while pending is not None:
+                next_type = pending.page_type
+
                 # Image BEFORE answer page = question image
                 if next_type == 'image' and question_group['answer_page'] is None:
-                    question_group['image_page'] = i
-                    i += 1
+                    question_group['image_page'] = pending.index
+                    pending = next(records, None)
                 # Answer page (short text with single option)
                 elif next_type == 'answer' and question_group['answer_page'] is None:
-                    question_group['answer_page'] = i
-                    i += 1
+                    question_group['answer_page'] = pending.index
+                    pending = next(records, None)
                 # Text/Image AFTER answer page = explanation
                 elif (next_type == 'explanation' or next_type == 'image') and question_group['answer_page'] is not None:
-                    question_group['explanation_page'] = i
-                    i += 1
+                    question_group['explanation_page'] = pending.index
+                    pending = next(records, None)
                     break  # End of this question
                 else:
                     break  # Start of next question
-            
-            questions.append(question_group)  # ← Move this OUTSIDE the inner while loop
-        else:
-            i += 1
+
+            yield question_group
+
+
+def group_question_pages(pages) -> List[Dict]:
+    """
+    Group pages into complete questions
+    Returns list of dicts with page indices for each question component
+    Accepts a list of pdfplumber pages or a PageCache
+    """
+    pages = as_page_cache(pages)
+    return list(iter_question_groups(pages[i] for i in range(len(pages))))
+
+
+OPTION_LETTERS = 'ABCDE'
+
+
+class QuestionRecord:
+    """
+    One extracted question
+    options holds the A-E option texts ('' when absent); missing images are
+    None; question_images/explanation_images (every image of the page) are
+    only set with --all-images
+    Cache entries and checkpoint journals keep the legacy dict layout
+    (Question, OptionA..OptionE, ..., 'null' for a missing image), see
+    from_dict/as_dict
+    """
+    __slots__ = ('question', 'options', 'correct_answer', 'answer_confidence', 'category', 'explanation',
+                 'question_image', 'explanation_image', 'question_images', 'explanation_images', 'duplicate')
+
+    def __init__(self, question: str = '', options: tuple = ('',) * len(OPTION_LETTERS),
+                 correct_answer: str = '', answer_confidence: Optional[float] = 0.0,
+                 category: str = '', explanation: str = '',
+                 question_image: Optional[str] = None, explanation_image: Optional[str] = None,
+                 question_images: Optional[List[str]] = None, explanation_images: Optional[List[str]] = None,
+                 duplicate: Optional[tuple] = None):
+        self.question = question
+        self.options = options
+        self.correct_answer = correct_answer
+        self.answer_confidence = answer_confidence
+        self.category = category
+        self.explanation = explanation
+        self.question_image = question_image
+        self.explanation_image = explanation_image
+        self.question_images = question_images
+        self.explanation_images = explanation_images
+        # (id, status, matched id, similarity) from DuplicateIndex.check; not cached
+        self.duplicate = duplicate
+
+    @classmethod
+    def from_dict(cls, q: Dict) -> 'QuestionRecord':
+        def image(key):
+            return None if q[key] == 'null' else q[key]
+
+        return cls(q['Question'], tuple(q[f'Option{letter}'] for letter in OPTION_LETTERS),
+                   q['CorrectAnswer'], q.get('AnswerConfidence'), q['Category'], q['Explanation'],
+                   image('QuestionImage'), image('ExplanationImage'),
+                   q.get('QuestionImages'), q.get('ExplanationImages'))
+
+    def as_dict(self) -> Dict:
+        q = {'Question': self.question}
+        q.update((f'Option{letter}', text) for letter, text in zip(OPTION_LETTERS, self.options))
+        q['CorrectAnswer'] = self.correct_answer
+        if self.answer_confidence is not None:
+            q['AnswerConfidence'] = self.answer_confidence
+        q['Category'] = self.category
+        q['Explanation'] = self.explanation
+        q['QuestionImage'] = self.question_image or 'null'
+        q['ExplanationImage'] = self.explanation_image or 'null'
+        if self.question_images is not None:
+            q['QuestionImages'] = self.question_images
+            q['ExplanationImages'] = self.explanation_images
+        return q
+
+    def copy(self) -> 'QuestionRecord':
+        return QuestionRecord(*(getattr(self, name) for name in self.__slots__))
+
+    def image_paths(self) -> set:
+        """Every image path the question references"""
+        paths = {self.question_image, self.explanation_image,
+                 *(self.question_images or ()), *(self.explanation_images or ())}
+        paths.discard(None)
+        return paths
+
+    def map_images(self, func) -> 'QuestionRecord':
+        """Replace each image path with func(path) in place"""
+        self.question_image = func(self.question_image) if self.question_image else None
+        self.explanation_image = func(self.explanation_image) if self.explanation_image else None
+        if self.question_images is not None:
+            self.question_images = [func(image) for image in self.question_images]
+            self.explanation_images = [func(image) for image in self.explanation_images]
+        return self
+
+    def output(self) -> Dict:
+        """The database import format"""
+        formatted = {
+            "question_text": self.question,
+            # "question_type": "radiogroup",
+            # Empty options are left out
+            "choices": {letter: text for letter, text in zip(OPTION_LETTERS, self.options) if text},
+            "correct_answer": self.correct_answer,
+            "answer_confidence": self.answer_confidence,
+            "category": self.category,
+            "explanation": self.explanation,
+            "image_url": self.question_image,
+            "explanation_image_url": self.explanation_image
+        }
+
+        # Every image of the page (--all-images)
+        if self.question_images is not None:
+            formatted["image_urls"] = self.question_images
+            formatted["explanation_image_urls"] = self.explanation_images
+
+        # Duplicate check against the index of earlier uploads (--dedupe-index)
+        if self.duplicate is not None:
+            question_id, status, match, similarity = self.duplicate
+            formatted["dedupe_id"] = question_id
+            formatted["duplicate_status"] = status
+            formatted["duplicate_of"] = match
+            formatted["duplicate_similarity"] = similarity
+        return formatted
+
+
+class QuestionStore:
+    """
+    Columnar store of QuestionRecords: one list per field, so a question
+    costs a few pointers instead of a dict (or record) of its own;
+    categories are interned as indices into a table seeded from CATEGORY_MAP
+    Iterating yields records rebuilt from the columns, one at a time
+    """
+
+    def __init__(self, records: Iterable[QuestionRecord] = ()):
+        from array import array
+
+        self.categories: List[str] = ['', *CATEGORY_MAP.values()]
+        self.category_index = {name: index for index, name in enumerate(self.categories)}
+        self.category_ids = array('H')
+        self.answer_confidences = array('d')  # NaN for unknown
+        self.questions: List[str] = []
+        self.options: List[List[str]] = [[] for _ in OPTION_LETTERS]
+        self.correct_answers: List[str] = []
+        self.explanations: List[str] = []
+        self.question_images: List[Optional[str]] = []
+        self.explanation_images: List[Optional[str]] = []
+        self.all_question_images: List[Optional[List[str]]] = []
+        self.all_explanation_images: List[Optional[List[str]]] = []
+        self.duplicates: List[Optional[tuple]] = []
+        for record in records:
+            self.append(record)
+
+    def _category_id(self, category: str) -> int:
+        index = self.category_index.get(category)
+        if index is None:
+            index = self.category_index[category] = len(self.categories)
+            self.categories.append(category)
+        return index
+
+    def append(self, record: QuestionRecord):
+        self.category_ids.append(self._category_id(record.category))
+        confidence = record.answer_confidence
+        self.answer_confidences.append(float('nan') if confidence is None else confidence)
+        self.questions.append(record.question)
+        for column, text in zip(self.options, record.options):
+            column.append(text)
+        self.correct_answers.append(record.correct_answer)
+        self.explanations.append(record.explanation)
+        self.question_images.append(record.question_image)
+        self.explanation_images.append(record.explanation_image)
+        self.all_question_images.append(record.question_images)
+        self.all_explanation_images.append(record.explanation_images)
+        self.duplicates.append(record.duplicate)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def __getitem__(self, index: int) -> QuestionRecord:
+        confidence = self.answer_confidences[index]
+        return QuestionRecord(
+            self.questions[index], tuple(column[index] for column in self.options),
+            self.correct_answers[index], None if confidence != confidence else confidence,
+            self.categories[self.category_ids[index]], self.explanations[index],
+            self.question_images[index], self.explanation_images[index],
+            self.all_question_images[index], self.all_explanation_images[index], self.duplicates[index],
+        )
+
+    def __iter__(self) -> Iterator[QuestionRecord]:
+        return (self[index] for index in range(len(self)))
+
+
+def as_question_record(q) -> QuestionRecord:
+    return q if isinstance(q, QuestionRecord) else QuestionRecord.from_dict(q)
+
+
+def extract_complete_question(pdf_path: str, pages, group: Dict, images: Optional[Dict[int, List[str]]] = None,
+                              all_images: bool = False,
+                              matcher: Optional['AnswerMatcher'] = None) -> QuestionRecord:
+    """
+    Extract all data for a complete question
+    Accepts a list of pdfplumber pages or a PageCache
+    images is the {page_num: [paths]} result of extract_images_batch; when
+    omitted the images for this group are extracted on the spot
+    all_images sets question_images/explanation_images to every image path
+    matcher is the document's AnswerMatcher (one is made if omitted)
+    """
+    pages = as_page_cache(pages)
+    if images is None:
+        images = extract_images_batch(pdf_path, collect_image_pages([group], pages))
+    question_data = QuestionRecord()
+    question_images: List[str] = []
+    explanation_images: List[str] = []
+    
+    # Extract question and options
+    page_model = pages[group['question_page']].model
+    question_data.question = extract_question(page_model)
+    options = extract_options(page_model)
+    question_data.options = tuple(options.get(letter, '') for letter in OPTION_LETTERS)
+    
+    # Extract category from question page (category key is at bottom)
+    category_key = pages[group['question_page']].category_key
+    question_data.category = map_category(category_key)
+    
+    # Extract explanation if exists
+    if group['explanation_page'] is not None:
+        exp_text = pages[group['explanation_page']].text
+        question_data.explanation = exp_text.strip()
+
+    # Extract images if they exist
+    if group['image_page'] is not None:
+        question_images = images.get(group['image_page'], [])
+        question_data.question_image = question_images[0] if question_images else None
+    
+    if group['explanation_page'] is not None:
+        exp_page = pages[group['explanation_page']]
+        if exp_page.image_count > 0:
+            explanation_images = images.get(group['explanation_page'], [])
+            question_data.explanation_image = explanation_images[0] if explanation_images else None
+
+    if all_images:
+        question_data.question_images = list(question_images)
+        question_data.explanation_images = list(explanation_images)
+
     
+    
+    # Extract correct answer from answer page
+    if group['answer_page'] is not None:
+        answer_page_model = pages[group['answer_page']].model
+        
+        # Extract correct answer letter (A/B/C/D/E) and how sure the match is
+        correct_answer_letter, confidence = resolve_correct_answer(answer_page_model, options, matcher)
+        question_data.correct_answer = correct_answer_letter
+        question_data.answer_confidence = confidence
+    
+    return question_data
+
+class PageOffsetIndex:
+    """
+    Question boundaries of a PDF, saved next to it as <pdf>.pages.json
+    Maps the first page of each question seen so far to its last page, so
+    a later --pages range that starts inside a question seeks back to the
+    question's first page instead of dropping it. Ignored once the PDF
+    (size or modification time) or EXTRACTOR_VERSION changes
+    """
+
+    def __init__(self, pdf_path: str):
+        import os
+
+        self.path = Path(f"{pdf_path}.pages.json")
+        self.questions: Dict[int, int] = {}  # first page -> last page
+        self.changed = False
+        try:
+            stat = os.stat(pdf_path)
+        except OSError:
+            self.fingerprint = None  # Unreadable PDF, reported when it is opened
+            return
+        self.fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('fingerprint') == self.fingerprint and saved.get('extractor_version') == EXTRACTOR_VERSION:
+            self.questions = {first: last for first, last in saved['questions']}
+
+    def add(self, group: Dict):
+        last = max(index for index in group.values() if index is not None)
+        if self.questions.get(group['question_page']) != last:
+            self.questions[group['question_page']] = last
+            self.changed = True
+
+    def question_start(self, page: int) -> int:
+        """First page of the known question containing page, else page itself"""
+        import bisect
+
+        firsts = sorted(self.questions)
+        position = bisect.bisect_right(firsts, page) - 1
+        if position >= 0 and page <= self.questions[firsts[position]]:
+            return firsts[position]
+        return page
+
+    def save(self):
+        if not self.changed or self.fingerprint is None:
+            return
+        data = {'fingerprint': self.fingerprint, 'extractor_version': EXTRACTOR_VERSION,
+                'questions': sorted(self.questions.items())}
+        try:
+            atomic_write(self.path, json.dumps(data).encode())
+        except OSError as e:
+            print(f"Warning: Could not save page index {self.path}: {e}")
+        self.changed = False
+
+
+class PageSelection:
+    """
+    Which part of a document to extract (--pages, --preview)
+    Questions whose first page lies in [start, stop) are extracted, their
+    answer and explanation pages are read even past stop; limit ends the
+    run after that many questions. offsets (the document's PageOffsetIndex)
+    moves start back to the first page of a question it falls inside and
+    records every question boundary seen
+    """
+    __slots__ = ('start', 'stop', 'limit', 'offsets')
+
+    def __init__(self, start: int = 0, stop: Optional[int] = None, limit: Optional[int] = None,
+                 offsets: Optional[PageOffsetIndex] = None):
+        self.start = offsets.question_start(start) if offsets is not None else start
+        self.stop = stop
+        self.limit = limit
+        self.offsets = offsets
+
+    @classmethod
+    def from_args(cls, args) -> Optional['PageSelection']:
+        """None for a whole-document run without --page-index"""
+        if args.pages is None and args.preview is None and not args.page_index:
+            return None
+        start, stop = args.pages or (0, None)
+        return cls(start, stop, args.preview, PageOffsetIndex(args.pdf_path))
+
+    @property
+    def partial(self) -> bool:
+        return self.start > 0 or self.stop is not None or self.limit is not None
+
+    def records(self, records: Iterable[PageInfo]) -> Iterator[PageInfo]:
+        """Pass records through until the first question page at or past stop"""
+        for record in records:
+            if self.stop is not None and record.index >= self.stop and record.page_type == 'question':
+                return
+            yield record
+
+
+def iter_grouped_pages(pdf_path: str, page_store: Optional['PageStore'] = None,
+                       backend: str = 'pdfplumber', selection: Optional[PageSelection] = None) -> Iterator[tuple]:
+    """
+    Streaming page analysis and grouping: yields (group, pages) as soon as
+    a question's last page has been seen, pages being a PageCache of just
+    that group's records; earlier pages are released as it goes
+    With a selection only its pages are opened, and reading stops as soon
+    as its last question (or the limit-th one) is complete
+    """
+    page_cache = PageCache([])
+
+    def remember(records):
+        for record in records:
+            page_cache.add(record)
+            yield record
+
+    records = iter_pages(pdf_path, page_store, backend, selection.start if selection is not None else 0)
+    if selection is not None:
+        records = selection.records(records)
+
+    emitted = 0
+    for group in iter_question_groups(remember(records)):
+        indices = [index for index in group.values() if index is not None]
+        if selection is not None and selection.offsets is not None:
+            selection.offsets.add(group)
+        yield group, PageCache.from_records([page_cache.records[index] for index in indices])
+        page_cache.evict_through(max(indices))
+        emitted += 1
+        if selection is not None and selection.limit is not None and emitted >= selection.limit:
+            break
+
+    if selection is not None and selection.offsets is not None:
+        selection.offsets.save()
+
+
+def iter_questions(pdf_path: str, output_dir: str = "extracted_images",
+                   page_store: Optional['PageStore'] = None, backend: str = 'pdfplumber',
+                   image_options: Optional[ImageOptions] = None,
+                   checkpoint: Optional['Checkpoint'] = None,
+                   selection: Optional[PageSelection] = None) -> Iterator[QuestionRecord]:
+    """
+    Streaming extraction pipeline
+    Pages are analyzed lazily, grouped on the fly and each question is
+    yielded as soon as it is complete; only the pages of the question in
+    progress are kept in memory
+    With a checkpoint, questions finished by an earlier run are replayed;
+    selection restricts the run to a page range or the first questions
+    """
+    image_options = image_options or ImageOptions()
+    matcher = AnswerMatcher()
+    with ImageExtractor(pdf_path, output_dir, image_options) as extractor:
+        for group, pages in iter_grouped_pages(pdf_path, page_store, backend, selection):
+            yield build_question(pdf_path, extractor, pages, group, matcher, checkpoint)
+
+
+def build_question(pdf_path: str, extractor: ImageExtractor, pages: 'PageCache', group: Dict,
+                   matcher: 'AnswerMatcher', checkpoint: Optional['Checkpoint'] = None) -> QuestionRecord:
+    """Save a group's images and extract its question (or replay it from the checkpoint)"""
+    question = checkpoint.question(group) if checkpoint is not None else None
+    if question is None:
+        images = extractor.extract(collect_image_pages([group], pages))
+        question = extract_complete_question(pdf_path, pages, group, images,
+                                             extractor.options.all_images, matcher)
+        if checkpoint is not None:
+            checkpoint.question_done(group, question)
+    instrumentation.question_done()
+    return question
+
+# Upload content types by image file extension
+IMAGE_CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+                       '.gif': 'image/gif', '.webp': 'image/webp'}
+
+
+class LocalDirectoryUploader:
+    """
+    Publishes images by copying them into a directory (e.g. one a web
+    server or CDN origin serves); URLs are base_url/<name>, or file:// URLs
+    """
+
+    def __init__(self, directory: str, base_url: Optional[str] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url
+
+    async def upload(self, data: bytes, name: str, content_type: str) -> str:
+        import asyncio
+
+        target = self.directory / name
+        await asyncio.to_thread(atomic_write, target, data)
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{name}"
+        return target.resolve().as_uri()
+
+
+class HttpPutUploader:
+    """
+    Publishes images with an HTTP PUT to endpoint/<name> (object stores,
+    Supabase storage, a local stub server); URLs are base_url/<name>,
+    or the PUT URL itself
+    """
+
+    def __init__(self, endpoint: str, base_url: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None, timeout: float = 60):
+        self.endpoint = endpoint.rstrip('/')
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.timeout = timeout
+
+    async def upload(self, data: bytes, name: str, content_type: str) -> str:
+        import asyncio
+
+        url = f"{self.endpoint}/{name}"
+        await asyncio.to_thread(self._put, url, data, content_type)
+        return f"{self.base_url.rstrip('/')}/{name}" if self.base_url else url
+
+    def _put(self, url: str, data: bytes, content_type: str):
+        import urllib.request
+
+        request = urllib.request.Request(url, data=data, method='PUT',
+                                         headers={'Content-Type': content_type, **self.headers})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def make_uploader(target: str, base_url: Optional[str] = None, headers: Optional[List[str]] = None):
+    """Uploader for --publish: an http(s) URL means HTTP PUT, anything else a local directory"""
+    if target.startswith(('http://', 'https://')):
+        parsed = {}
+        for header in headers or []:
+            name, _, value = header.partition(':')
+            parsed[name.strip()] = value.strip()
+        return HttpPutUploader(target, base_url, parsed)
+    return LocalDirectoryUploader(target, base_url)
+
+
+class ImagePublisher:
+    """
+    Replaces a question's local image paths with published URLs
+    Each file is uploaded once under its content hash, so re-runs and
+    images shared between questions or documents map to the same object;
+    at most `concurrency` uploads are in flight
+    """
+
+    def __init__(self, uploader, concurrency: int = 4):
+        import asyncio
+
+        self.uploader = uploader
+        self.slots = asyncio.Semaphore(concurrency)
+        self.uploads: Dict[str, 'asyncio.Task'] = {}
+        self.script_dir = Path(__file__).resolve().parent
+
+    async def _upload(self, image: str) -> str:
+        import asyncio
+        import hashlib
+
+        async with self.slots:
+            data = await asyncio.to_thread((self.script_dir / image).read_bytes)
+            suffix = Path(image).suffix.lower()
+            name = hashlib.sha256(data).hexdigest()[:32] + suffix
+            return await self.uploader.upload(data, name, IMAGE_CONTENT_TYPES.get(suffix, 'application/octet-stream'))
+
+    async def url(self, image: Optional[str]) -> Optional[str]:
+        """Published URL for a local image path, or None if the upload failed"""
+        import asyncio
+
+        if image is None:
+            return image
+        if image not in self.uploads:
+            self.uploads[image] = asyncio.ensure_future(self._upload(image))
+        try:
+            return await self.uploads[image]
+        except Exception as e:
+            print(f"Warning: Could not publish image {image}: {e}")
+            return None
+
+    async def publish(self, q: QuestionRecord) -> QuestionRecord:
+        q = q.copy()
+        q.question_image = await self.url(q.question_image)
+        q.explanation_image = await self.url(q.explanation_image)
+        if q.question_images is not None:
+            q.question_images = [url for url in [await self.url(image) for image in q.question_images] if url]
+            q.explanation_images = [url for url in [await self.url(image) for image in q.explanation_images] if url]
+        return q
+
+
+async def publish_questions(questions, publisher: ImagePublisher, queue_size: int = 8) -> QuestionStore:
+    """
+    Publish stage: start each question's uploads as it arrives (at most
+    queue_size questions waiting on uploads), collect results in order
+    questions may be a plain or an async iterable
+    """
+    import asyncio
+
+    if not hasattr(questions, '__aiter__'):
+        questions = _as_async(questions)
+
+    pending = []
+    results = QuestionStore()
+    async for q in questions:
+        if len(pending) >= queue_size:
+            results.append(await pending.pop(0))
+        pending.append(asyncio.ensure_future(publisher.publish(q)))
+    for task in pending:
+        results.append(await task)
+    return results
+
+
+async def _as_async(items: Iterable):
+    for item in items:
+        yield item
+
+
+async def publish_pipeline(pdf_path: str, publisher: ImagePublisher, output_dir: str = IMAGE_ROOT,
+                           page_store: Optional['PageStore'] = None, backend: str = 'pdfplumber',
+                           image_options: Optional[ImageOptions] = None,
+                           checkpoint: Optional['Checkpoint'] = None, queue_size: int = 8,
+                           selection: Optional[PageSelection] = None) -> QuestionStore:
+    """
+    Extraction as three concurrent stages joined by bounded queues (--publish):
+    parse (page analysis + grouping, worker thread) -> encode (question
+    extraction + image encoding, worker thread) -> publish (async uploads)
+    Uploads of earlier questions overlap parsing of later pages, so wall
+    time approaches the slowest stage instead of the sum of all three
+    """
+    import asyncio
+
+    image_options = image_options or ImageOptions()
+    matcher = AnswerMatcher()
+    parsed: asyncio.Queue = asyncio.Queue(queue_size)
+    encoded: asyncio.Queue = asyncio.Queue(queue_size)
+    groups = iter_grouped_pages(pdf_path, page_store, backend, selection)
+
+    async def parse():
+        while True:
+            item = await asyncio.to_thread(next, groups, None)
+            await parsed.put(item)
+            if item is None:
+                return
+
+    async def encode():
+        with ImageExtractor(pdf_path, output_dir, image_options) as extractor:
+            while (item := await parsed.get()) is not None:
+                group, pages = item
+                question = await asyncio.to_thread(build_question, pdf_path, extractor, pages,
+                                                   group, matcher, checkpoint)
+                await encoded.put(question)
+        await encoded.put(None)
+
+    async def encoded_questions():
+        while (question := await encoded.get()) is not None:
+            yield question
+
+    _, _, results = await asyncio.gather(parse(), encode(),
+                                         publish_questions(encoded_questions(), publisher, queue_size))
+    return results
+
+
+# Bump whenever a change alters extracted output, so cached results are not reused
+EXTRACTOR_VERSION = "3"
+
+
+def page_content_hashes(pdf_path: str, backend: str = 'pdfplumber') -> List[str]:
+    """
+    Hash each page's content: its content stream plus the fonts, images
+    and form XObjects it references. Unchanged pages of an edited PDF keep
+    their hash even if other pages moved or changed
+    The text backend is part of the hash: each backend's pages are stored apart
+    """
+    import fitz  # PyMuPDF
+    import hashlib
+
+    hashes = []
+    stream_digests: Dict[int, bytes] = {}
+
+    def stream_digest(doc, xref: int) -> bytes:
+        if xref not in stream_digests:
+            stream_digests[xref] = hashlib.sha256(doc.xref_stream_raw(xref) or b'').digest()
+        return stream_digests[xref]
+
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            h = hashlib.sha256(f"{EXTRACTOR_VERSION}:{backend}".encode())
+            h.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+            h.update(page.read_contents())
+            for font in page.get_fonts():
+                h.update(repr(font[1:]).encode())  # xref numbers may shift between saves
+            for image in page.get_images():
+                h.update(stream_digest(doc, image[0]))
+            for xobject in page.get_xobjects():
+                h.update(stream_digest(doc, xobject[0]))
+            hashes.append(h.hexdigest())
+    return hashes
+
+
+# Page store rows written per transaction; the shared database is only
+# write-locked while a batch is flushed, never for a whole run
+PAGE_STORE_BATCH = 32
+
+
+class PageStore:
+    """
+    Second-level cache: page content hash -> analyzed text and image count
+    Lets a slightly edited PDF skip layout analysis for every unchanged page
+    New rows and last-used updates are buffered and flushed in short
+    transactions of PAGE_STORE_BATCH pages, so concurrent runs share one
+    database; a database another run holds locked counts as a miss
+    """
+
+    def __init__(self, db_path: str, hashes: List[str], timeout: float = 5):
+        import sqlite3
+
+        self.hashes = hashes
+        self.hits = 0
+        self.misses = 0
+        self.pending: List[tuple] = []  # Rows not written yet
+        self.touched: List[str] = []    # Hashes whose last_used is not updated yet
+        # The --publish pipeline reads pages in a worker thread; access is never concurrent
+        self.conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "hash TEXT PRIMARY KEY, text TEXT NOT NULL, image_count INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+
+    def lookup(self, index: int) -> Optional[PageInfo]:
+        import sqlite3
+
+        try:
+            row = self.conn.execute("SELECT text, image_count FROM pages WHERE hash = ?",
+                                    (self.hashes[index],)).fetchone()
+        except sqlite3.OperationalError:
+            row = None  # Locked by another run's flush: parse the page instead
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched.append(self.hashes[index])
+        self._maybe_flush()
+        return PageInfo(index, row[0], row[1])
+
+    def save(self, record: PageInfo):
+        import time
+
+        self.pending.append((self.hashes[record.index], record.text, record.image_count, time.time()))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.pending) + len(self.touched) >= PAGE_STORE_BATCH:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows in one short transaction; dropped (not cached) if the database stays locked"""
+        import sqlite3
+        import time
+
+        if not self.pending and not self.touched:
+            return
+        now = time.time()
+        try:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", self.pending)
+                self.conn.executemany("UPDATE pages SET last_used = ? WHERE hash = ?",
+                                      [(now, page_hash) for page_hash in self.touched])
+        except sqlite3.OperationalError as e:
+            print(f"Warning: Page store busy, {len(self.pending)} pages not cached: {e}")
+        self.pending.clear()
+        self.touched.clear()
+
+    def trim(self, keep_fraction: float = 0.5):
+        """Drop the least recently used rows"""
+        self.flush()
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()
+        self.conn.execute("DELETE FROM pages WHERE hash IN "
+                          "(SELECT hash FROM pages ORDER BY last_used LIMIT ?)",
+                          (count - int(count * keep_fraction),))
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class Checkpoint:
+    """
+    Append-only JSON Lines journal of a job's progress (--checkpoint)
+    Every analyzed page and every finished question is appended as it
+    completes, so re-running the same job after a crash or timeout skips
+    the pages and questions already done. The journal starts with the
+    document key and is discarded if the PDF or output options changed
+    Acts as the run's page store, falling back to the shared PageStore
+    Only the journal offsets of an earlier run's pages and questions are
+    kept; their entries are read back when they are needed, so memory does
+    not grow with the document. The journal is shared by the --publish
+    pipeline's threads, so reads and appends hold a lock
+    """
+
+    def __init__(self, path: str, document_key: str, page_store: Optional[PageStore] = None):
+        import threading
+
+        self.path = Path(path)
+        self.page_store = page_store
+        self.pages: Dict[int, int] = {}  # index -> journal offset (earlier runs)
+        self.questions: Dict[int, int] = {}  # question page index -> journal offset (earlier runs)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.reader = None
+
+        resumed = self.path.exists() and self._replay(document_key)
+        self.f = open(self.path, 'a' if resumed else 'w', encoding='utf-8')
+        if not resumed:
+            self._append({'type': 'header', 'key': document_key})
+
+    def _replay(self, document_key: str) -> bool:
+        """Index a previous run's journal; False if it belongs to another document"""
+        good_bytes = 0
+        with open(self.path, 'rb') as f:
+            for number, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Torn final write of a crashed run
+                if number == 0 and (entry.get('type') != 'header' or entry.get('key') != document_key):
+                    return False
+                if entry['type'] == 'page':
+                    self.pages[entry['index']] = good_bytes
+                elif entry['type'] == 'question':
+                    self.questions[entry['page']] = good_bytes
+                good_bytes += len(line)
+        if good_bytes == 0:
+            return False
+        with open(self.path, 'r+b') as f:
+            f.truncate(good_bytes)  # Drop the torn line before appending
+        return True
+
+    def _append(self, entry: Dict):
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def _read(self, offset: int) -> Dict:
+        with self.lock:
+            if self.reader is None:
+                self.reader = open(self.path, 'rb')
+            self.reader.seek(offset)
+            return json.loads(self.reader.readline())
+
+    def lookup(self, index: int) -> Optional[PageInfo]:
+        if index in self.pages:
+            self.hits += 1
+            entry = self._read(self.pages[index])
+            return PageInfo(index, entry['text'], entry['image_count'])
+        record = self.page_store.lookup(index) if self.page_store is not None else None
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._save_page(record)
+        return record
+
+    def save(self, record: PageInfo):
+        self._save_page(record)
+        if self.page_store is not None:
+            self.page_store.save(record)
+
+    def _save_page(self, record: PageInfo):
+        self._append({'type': 'page', 'index': record.index,
+                      'text': record.text, 'image_count': record.image_count})
+
+    def question(self, group: Dict) -> Optional[QuestionRecord]:
+        """The question finished for this group by an earlier run, if any"""
+        offset = self.questions.get(group['question_page'])
+        if offset is None:
+            return None
+        return QuestionRecord.from_dict(self._read(offset)['question'])
+
+    def question_done(self, group: Dict, question: QuestionRecord):
+        self._append({'type': 'question', 'page': group['question_page'], 'question': question.as_dict()})
+
+    def close(self):
+        self.f.close()
+        if self.reader is not None:
+            self.reader.close()
+
+
+class ExtractionCache:
+    """
+    Disk-backed, content-addressed cache of extraction results
+    documents/<key>/ holds the extracted questions (JSON Lines) and the
+    images they reference, keyed by SHA-256 of the PDF bytes + EXTRACTOR_VERSION
+    + text backend + output-affecting options (salt);
+    pages.sqlite is the per-page PageStore. Entries are evicted least
+    recently used first once the cache grows past max_bytes
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.root = Path(cache_dir)
+        self.documents_dir = self.root / 'documents'
+        self.documents_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def document_key(pdf_path: str, salt: str = '', backend: str = 'pdfplumber') -> str:
+        import hashlib
+
+        h = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        h.update(f"{EXTRACTOR_VERSION}:{backend}".encode())
+        h.update(salt.encode())
+        return h.hexdigest()
+
+    def load(self, key: str, output_dir: str = IMAGE_ROOT) -> Optional[Iterator[QuestionRecord]]:
+        """
+        On a hit, restore the cached images into output_dir (relative to the
+        script) and return an iterator over the cached questions, with image
+        paths pointing there; None on a miss
+        """
+        import os
+
+        entry = self.documents_dir / key
+        questions_file = entry / 'questions.jsonl'
+        if not questions_file.exists():
+            return None
+
+        target_dir = Path(_image_output_dir(output_dir))
+        for image in (entry / 'images').rglob('*'):
+            if image.is_file():
+                atomic_write(target_dir / image.name, image.read_bytes())
+        os.utime(entry)  # Mark as recently used
+
+        def questions():
+            with open(questions_file, encoding='utf-8') as f:
+                for line in f:
+                    yield rebase_images(QuestionRecord.from_dict(json.loads(line)), output_dir)
+        return questions()
+
+    def record(self, key: str, questions: Iterable[QuestionRecord]) -> Iterator[QuestionRecord]:
+        """
+        Pass questions through while writing them to a new cache entry
+        The entry only becomes visible (atomic rename) once the stream completes
+        Images are stored by file name and relocated to the requesting job on load
+        """
+        import os
+        import shutil
+
+        script_dir = Path(_image_output_dir('.'))
+        tmp = self.documents_dir / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        (tmp / 'images').mkdir(parents=True)
+        try:
+            with open(tmp / 'questions.jsonl', 'w', encoding='utf-8') as f:
+                for q in questions:
+                    f.write(json.dumps(q.as_dict(), ensure_ascii=False) + '\n')
+                    for image in q.image_paths():
+                        if (script_dir / image).is_file():
+                            shutil.copy2(script_dir / image, tmp / 'images' / Path(image).name)
+                    yield q
+            try:
+                os.rename(tmp, self.documents_dir / key)
+            except OSError:
+                pass  # Another job cached the same document first
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def page_store(self, pdf_path: str, backend: str = 'pdfplumber') -> PageStore:
+        return PageStore(str(self.root / 'pages.sqlite'), page_content_hashes(pdf_path, backend))
+
+    def evict(self):
+        """Remove least recently used document entries, then old page rows, until under max_bytes"""
+        import shutil
+
+        def size(path: Path) -> int:
+            if path.is_file():
+                return path.stat().st_size
+            return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+        entries = sorted((entry for entry in self.documents_dir.iterdir() if not entry.name.startswith('.')),
+                         key=lambda entry: entry.stat().st_mtime)
+        total = size(self.root)
+        for entry in entries:
+            if total <= self.max_bytes:
+                return
+            total -= size(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+
+        pages_db = self.root / 'pages.sqlite'
+        if total > self.max_bytes and pages_db.exists():
+            store = PageStore(str(pages_db), [])
+            store.trim()
+            store.close()
+
+
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 16 bands x 4 rows: similarity 0.8 becomes a candidate with probability > 0.999
+MERSENNE_PRIME = (1 << 61) - 1
+DUPLICATE_NEW = 'new'
+DUPLICATE_EXACT = 'exact_duplicate'
+DUPLICATE_NEAR = 'near_duplicate'
+
+
+def _minhash_parameters() -> List[tuple]:
+    import random
+
+    rng = random.Random(61)  # Fixed seed: signatures are persisted in the index
+    return [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+
+
+MINHASH_PARAMETERS = _minhash_parameters()
+
+
+def question_digest(q: QuestionRecord) -> str:
+    """Id of a question in the duplicate index: hash of its normalized text and options"""
+    import hashlib
+
+    parts = [normalize_answer_text(q.question), *(normalize_answer_text(text) for text in q.options)]
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()[:16]
+
+
+def question_shingles(q: QuestionRecord) -> set:
+    """Word pairs of the normalized question text plus each whole option, so reordered options still match"""
+    words = TOKEN_RE.findall(normalize_answer_text(q.question))
+    shingles = {' '.join(words[i:i + 2]) for i in range(max(1, len(words) - 1))}
+    shingles.update('option:' + normalize_answer_text(text) for text in q.options if text)
+    return shingles
+
+
+def minhash_signature(shingles: Iterable[str]):
+    """
+    MINHASH_PERMUTATIONS minimum hashes (low 32 bits kept); the share of
+    equal positions estimates Jaccard similarity
+    """
+    import zlib
+    from array import array
+
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingles]
+    return array('I', [min([(a * h + b) % MERSENNE_PRIME for h in hashes]) & 0xFFFFFFFF
+                       for a, b in MINHASH_PARAMETERS])
+
+
+def lsh_keys(signature, category: str) -> List[int]:
+    """One bucket key per band of the signature; the category is part of the key, partitioning the buckets"""
+    import hashlib
+
+    rows = len(signature) // LSH_BANDS
+    return [int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8,
+                                           key=category.encode()[:64], person=band.to_bytes(2, 'big')).digest(),
+                           'big', signed=True)
+            for band in range(LSH_BANDS)]
+
+
+class DuplicateIndex:
+    """
+    Persistent near-duplicate index of every question extracted so far (--dedupe-index)
+    Questions are MinHash signatures of their normalized text and options;
+    the LSH bucket table (LSH_BANDS band keys per signature, each keyed by
+    category too, so categories never share a bucket) turns finding
+    similar questions into one indexed lookup
+    instead of a scan of the corpus. check() flags each question as new,
+    an exact duplicate (same normalized text and options) or a near
+    duplicate (estimated similarity >= threshold) of an indexed question
+    New questions are held back until commit(), which writes them in one
+    short transaction, so a failed run leaves the index unchanged and
+    parallel batch workers only lock it briefly
+    """
+
+    def __init__(self, db_path: str, threshold: float = 0.8, source: str = ''):
+        import sqlite3
+
+        self.threshold = threshold
+        self.source = source
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS questions ("
+                          "number INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, category TEXT NOT NULL, "
+                          "signature BLOB NOT NULL, source TEXT NOT NULL, added REAL NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (key INTEGER NOT NULL, question INTEGER NOT NULL, "
+                          "PRIMARY KEY (key, question)) WITHOUT ROWID")
+        self.conn.commit()
+        # Checked but not yet committed: id -> (category, signature, bucket keys)
+        self.pending: Dict[str, tuple] = {}
+        self.pending_buckets: Dict[int, List[str]] = {}
+        self.counts = {DUPLICATE_NEW: 0, DUPLICATE_EXACT: 0, DUPLICATE_NEAR: 0}
+
+    def _candidates(self, keys: List[int]) -> Iterator[tuple]:
+        """(id, signature) of every question sharing a bucket with keys"""
+        from array import array
+
+        seen = set()
+        for key in keys:
+            for question_id in self.pending_buckets.get(key, ()):
+                if question_id not in seen:
+                    seen.add(question_id)
+                    yield question_id, self.pending[question_id][1]
+        rows = self.conn.execute(
+            "SELECT DISTINCT q.id, q.signature FROM buckets b JOIN questions q ON q.number = b.question "
+            f"WHERE b.key IN ({', '.join('?' * len(keys))})", keys)
+        for question_id, signature in rows:
+            if question_id not in seen:
+                yield question_id, array('I', signature)
+
+    def check(self, q: QuestionRecord) -> QuestionRecord:
+        """Set q.duplicate to (id, status, matched id, similarity) and queue new questions for commit()"""
+        question_id = question_digest(q)
+        if question_id in self.pending or self.conn.execute(
+                "SELECT 1 FROM questions WHERE id = ?", (question_id,)).fetchone():
+            q.duplicate = (question_id, DUPLICATE_EXACT, question_id, 1.0)
+            self.counts[DUPLICATE_EXACT] += 1
+            return q
+
+        signature = minhash_signature(question_shingles(q))
+        keys = lsh_keys(signature, q.category)
+        match, similarity = None, 0.0
+        for candidate_id, candidate in self._candidates(keys):
+            estimate = sum(x == y for x, y in zip(signature, candidate)) / len(signature)
+            if estimate > similarity:
+                match, similarity = candidate_id, estimate
+
+        if match is not None and similarity >= self.threshold:
+            status = DUPLICATE_NEAR
+            q.duplicate = (question_id, status, match, round(similarity, 4))
+        else:
+            status = DUPLICATE_NEW
+            q.duplicate = (question_id, status, None, None)
+        self.counts[status] += 1
+
+        # Near duplicates are indexed too: later uploads may be closer to them
+        self.pending[question_id] = (q.category, signature, keys)
+        for key in keys:
+            self.pending_buckets.setdefault(key, []).append(question_id)
+        return q
+
+    def flag(self, questions: Iterable[QuestionRecord]) -> Iterator[QuestionRecord]:
+        for q in questions:
+            yield self.check(q)
+
+    def commit(self):
+        import time
+
+        now = time.time()
+        with self.conn:
+            for question_id, (category, signature, keys) in self.pending.items():
+                inserted = self.conn.execute(
+                    "INSERT OR IGNORE INTO questions (id, category, signature, source, added) VALUES (?, ?, ?, ?, ?)",
+                    (question_id, category, signature.tobytes(), self.source, now))
+                if inserted.rowcount:  # Another run may have indexed it meanwhile
+                    self.conn.executemany("INSERT OR IGNORE INTO buckets VALUES (?, ?)",
+                                          [(key, inserted.lastrowid) for key in keys])
+        self.pending.clear()
+        self.pending_buckets.clear()
+
+    def close(self):
+        self.conn.close()
+
+
+# Category shards (--shards): questions per independently compressed block.
+# Reading a sampled question decompresses only its block; 32 keeps ~80% of
+# the compression of one stream per shard (benchmark.py shards)
+SHARD_BLOCK_QUESTIONS = 32
+SHARD_MANIFEST = 'manifest.json'
+SHARD_FORMAT_VERSION = 2
+# Images referenced by shards, named by content hash, relative to the shard directory
+SHARD_IMAGES = 'images'
+# Shard of the questions whose category key was not recognised
+SHARD_UNCATEGORIZED = 'Uncategorized'
+SHARD_EXTENSIONS = {'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+_ZSTANDARD = None
+
+
+def _zstandard():
+    """zstandard module, or None (with a warning, once) if it is not installed"""
+    global _ZSTANDARD
+    if _ZSTANDARD is None:
+        try:
+            import zstandard
+        except ImportError:
+            print("Warning: zstandard is not installed, shards are gzip compressed")
+            zstandard = False
+        _ZSTANDARD = zstandard
+    return _ZSTANDARD or None
+
+
+def compress_block(data: bytes, compression: str) -> bytes:
+    """One shard block; the same questions always compress to the same bytes"""
+    if compression == 'zstd':
+        return _zstandard().ZstdCompressor(level=19).compress(data)
+    import gzip
+
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress_block(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return _zstandard().ZstdDecompressor().decompress(data)
+    import gzip
+
+    return gzip.decompress(data)
+
+
+class ShardBuilder:
+    """
+    Category-sharded serving artifacts (--shards DIR): one compressed JSON
+    Lines file per category and a manifest.json giving each shard's file,
+    question count, size, sha256 and ETag
+    A shard is a run of independently compressed blocks of
+    SHARD_BLOCK_QUESTIONS questions (gzip members or zstd frames, so it
+    still decompresses as one stream); the manifest lists every block's byte
+    offset and length, so a server can read (HTTP Range, mmap) just the
+    blocks holding a random sample instead of the whole category
+    Shards hold a stable serving projection of each question: no duplicate
+    flags, and images as published URLs or as SHARD_IMAGES/<content hash>
+    copies in DIR, never job workspace paths. Re-extracting the same
+    questions therefore produces the same bytes
+    Files are named by content hash and never rewritten: a category whose
+    questions are unchanged since the last build keeps its file, ETag and
+    mtime, and a category missing from this upload keeps its previous shard
+    unless prune is set; files the new manifest no longer lists are removed
+    after it is in place. Blocks are compressed as questions arrive, so
+    memory is the compressed size of the bank, not its text
+    """
+
+    def __init__(self, directory: str, compression: str = 'gzip', source: str = '', prune: bool = False):
+        if compression == 'zstd' and _zstandard() is None:
+            compression = 'gzip'
+        self.directory = Path(directory)
+        self.compression = compression
+        self.source = source
+        self.prune = prune
+        self.blocks: Dict[str, List[bytes]] = {}   # category -> compressed blocks
+        self.pending: Dict[str, List[bytes]] = {}  # category -> lines of its unfinished block
+        self.counts: Dict[str, int] = {}
+        self.images: Dict[str, set] = {}           # category -> image names in SHARD_IMAGES
+        self.image_refs: Dict[str, Optional[str]] = {}  # local path -> shard reference
+        self.script_dir = Path(__file__).resolve().parent
+        self.manifest: Dict = {}
+
+    def image_ref(self, image: str) -> Optional[str]:
+        """
+        Shard reference for an image: published URLs as is, local files
+        copied into SHARD_IMAGES under their content hash (the name
+        ImagePublisher uploads them under)
+        """
+        import hashlib
+
+        if '://' in image:
+            return image
+        if image not in self.image_refs:
+            try:
+                data = (self.script_dir / image).read_bytes()
+            except OSError as e:
+                print(f"Warning: Could not add image {image} to shards: {e}")
+                self.image_refs[image] = None
+            else:
+                name = hashlib.sha256(data).hexdigest()[:32] + Path(image).suffix.lower()
+                target = self.directory / SHARD_IMAGES / name
+                if not target.is_file():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    atomic_write(target, data)
+                self.image_refs[image] = f"{SHARD_IMAGES}/{name}"
+        return self.image_refs[image]
+
+    def serving_output(self, q: QuestionRecord) -> Dict:
+        """The shard line of a question: output() without duplicate flags, with shard image references"""
+        q = q.copy()
+        q.duplicate = None  # Depends on what was indexed before, not on the question
+        q.map_images(self.image_ref)
+        if q.question_images is not None:
+            q.question_images = [image for image in q.question_images if image]
+            q.explanation_images = [image for image in q.explanation_images if image]
+        return q.output()
+
+    def add(self, q: QuestionRecord):
+        category = q.category or SHARD_UNCATEGORIZED
+        item = self.serving_output(q)
+        line = json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n'
+        pending = self.pending.setdefault(category, [])
+        pending.append(line.encode('utf-8'))
+        self.counts[category] = self.counts.get(category, 0) + 1
+        images = self.images.setdefault(category, set())
+        for image in (item['image_url'], item['explanation_image_url'],
+                      *item.get('image_urls', ()), *item.get('explanation_image_urls', ())):
+            if image and image.startswith(f"{SHARD_IMAGES}/"):
+                images.add(image[len(SHARD_IMAGES) + 1:])
+        if len(pending) == SHARD_BLOCK_QUESTIONS:
+            self._finish_block(category)
+
+    def _finish_block(self, category: str):
+        pending = self.pending.pop(category, None)
+        if pending:
+            self.blocks.setdefault(category, []).append(compress_block(b''.join(pending), self.compression))
+
+    def collect(self, questions: Iterable[QuestionRecord]) -> Iterator[QuestionRecord]:
+        """Pass questions through, adding each to its category's shard"""
+        for q in questions:
+            self.add(q)
+            yield q
+
+    def _previous_manifest(self) -> Dict:
+        try:
+            with open(self.directory / SHARD_MANIFEST, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if manifest.get('version') == SHARD_FORMAT_VERSION else {}
+
+    def build(self) -> Dict[str, int]:
+        """
+        Write new or changed shards, then the manifest; returns how many
+        shards were written, kept (unchanged or not in this upload) and removed
+        """
+        import hashlib
+        import os
+
+        for category in list(self.pending):
+            self._finish_block(category)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        previous = self._previous_manifest().get('categories', {})
+        stats = {'written': 0, 'kept': 0, 'removed': 0}
+
+        categories = {}
+        for category in sorted(self.blocks):
+            blocks = self.blocks[category]
+            data = b''.join(blocks)
+            digest = hashlib.sha256(data).hexdigest()
+            name = re.sub(r'[^A-Za-z0-9_-]', '_', category)
+            file_name = f"{name}.{digest[:16]}{SHARD_EXTENSIONS[self.compression]}"
+            path = self.directory / file_name
+            if previous.get(category, {}).get('sha256') == digest and path.is_file():
+                stats['kept'] += 1
+            else:
+                atomic_write(path, data)
+                stats['written'] += 1
+
+            offsets, offset = [], 0
+            for block in blocks:
+                offsets.append([offset, len(block)])
+                offset += len(block)
+            categories[category] = {
+                'file': file_name,
+                'count': self.counts[category],
+                'bytes': len(data),
+                'sha256': digest,
+                'etag': f'"{digest[:32]}"',
+                'compression': self.compression,
+                'blocks': offsets,
+                'images': sorted(self.images.get(category, ())),
+                'source': self.source,
+            }
+
+        if not self.prune:
+            # A partial upload only replaces the categories it contains
+            for category, entry in previous.items():
+                if category not in categories:
+                    categories[category] = entry
+                    stats['kept'] += 1
+            categories = dict(sorted(categories.items()))
+
+        self.manifest = {
+            'version': SHARD_FORMAT_VERSION,
+            'source': self.source,
+            'block_questions': SHARD_BLOCK_QUESTIONS,
+            'questions': sum(entry['count'] for entry in categories.values()),
+            'categories': categories,
+        }
+        atomic_write(self.directory / SHARD_MANIFEST,
+                     json.dumps(self.manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+        current = {entry['file'] for entry in categories.values()}
+        current_images = {image for entry in categories.values() for image in entry.get('images', ())}
+        for entry in previous.values():
+            file_name = entry.get('file')
+            if file_name and file_name not in current and os.path.basename(file_name) == file_name:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.directory / file_name)
+                    stats['removed'] += 1
+            for image in entry.get('images', ()):
+                if image not in current_images and os.path.basename(image) == image:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self.directory / SHARD_IMAGES / image)
+        return stats
+
+
+def read_shard_questions(directory: str, category: str, indices: Optional[Iterable[int]] = None) -> List[Dict]:
+    """
+    Questions of one category shard built by ShardBuilder, in shard order:
+    all of them, or only those at indices (e.g. a random exam sample), for
+    which just the blocks holding them are read and decompressed
+    """
+    directory = Path(directory)
+    with open(directory / SHARD_MANIFEST, encoding='utf-8') as f:
+        manifest = json.load(f)
+    entry = manifest['categories'][category]
+    per_block = manifest['block_questions']
+    wanted = range(entry['count']) if indices is None else sorted(set(indices))
+
+    questions = []
+    with open(directory / entry['file'], 'rb') as f:
+        for block_number, members in itertools.groupby(wanted, key=lambda index: index // per_block):
+            offset, length = entry['blocks'][block_number]
+            f.seek(offset)
+            lines = decompress_block(f.read(length), entry['compression']).splitlines()
+            questions.extend(json.loads(lines[index % per_block]) for index in members)
     return questions
 
-def extract_complete_question(pdf_path: str, pages, group: Dict) -> Dict:
+
+def format_question(q) -> Dict:
+    """
+    Convert an extracted question (QuestionRecord or legacy dict) into the
+    database import format
+    """
+    return as_question_record(q).output()
+
+
+_encode_json_string = json.encoder.encode_basestring  # The C encoder when available
+
+
+def dumps_indented(value, prefix: str = '') -> str:
+    """
+    json.dumps(value, indent=2, ensure_ascii=False) for JSON-native values,
+    nested at prefix; json only uses its C encoder without indent=, this
+    avoids the pure-Python fallback that dominated writing large outputs
+    """
+    if isinstance(value, str):
+        return _encode_json_string(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, (int, float)):
+        return json.dumps(value)
+    inner = prefix + '  '
+    if isinstance(value, dict):
+        if not value:
+            return '{}'
+        items = [f"{inner}{_encode_json_string(key)}: {dumps_indented(item, inner)}" for key, item in value.items()]
+        return '{\n' + ',\n'.join(items) + '\n' + prefix + '}'
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return '[]'
+        return '[\n' + ',\n'.join(inner + dumps_indented(item, inner) for item in value) + '\n' + prefix + ']'
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array one item at a time
+    Output is byte-identical to json.dump(items, f, indent=2, ensure_ascii=False)
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, item: Dict):
+        self.f.write('[\n' if self.count == 0 else ',\n')
+        self.f.write('  ' + dumps_indented(item, '  '))
+        self.count += 1
+
+    def close(self):
+        self.f.write('\n]' if self.count else '[]')
+
+
+class JsonLinesWriter:
+    """
+    Writes one compact JSON object per line (JSON Lines)
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, item: Dict):
+        self.f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+class ExcelWriter:
     """
-    Extract all data for a complete question
+    Writes the xlsx review sheet for content editors: a Questions sheet
+    plus a Categories sheet feeding a dropdown on the Category column
+    Uses openpyxl's write-only mode, where each row is serialized to a temp
+    file as it is appended instead of being kept as cell objects, so memory
+    stays flat however many questions are written: about 6.5k rows/s
+    under 1 MB traced at 20k questions (benchmark.py records); openpyxl
+    serializes faster when lxml is installed
     """
-    question_data = {
-        'Question': '',
-        'OptionA': '',
-        'OptionB': '',
-        'OptionC': '',
-        'OptionD': '',
-        'OptionE': '',
-        'CorrectAnswer': '',
-        'Category': '',
-        'Explanation': '',
-        'QuestionImage': 'null',
-        'ExplanationImage': 'null',
-    }
-    
-    # Extract question and options
-    page_text = pages[group['question_page']].extract_text()
-    question_data['Question'] = extract_question(page_text)
-    options = extract_options(page_text)
-    
-    question_data['OptionA'] = options.get('A', '')
-    question_data['OptionB'] = options.get('B', '')
-    question_data['OptionC'] = options.get('C', '')
-    question_data['OptionD'] = options.get('D', '')
-    question_data['OptionE'] = options.get('E', '')
-    
-    # Extract category from question page (category key is at bottom)
-    category_key = extract_category_key(page_text)
-    category_name = map_category(category_key)
-    question_data['Category'] = category_name
-    
-    # Extract explanation if exists
-    if group['explanation_page'] is not None:
-        exp_text = pages[group['explanation_page']].extract_text()
-        question_data['Explanation'] = exp_text.strip()
+    binary = True
+    HEADERS = ["Question", "OptionA", "OptionB", "OptionC", "OptionD", "OptionE",
+               "CorrectAnswer", "Category", "Explanation", "QuestionImage", "ExplanationImage",
+               "ImageCheck", "AnswerConfidence", "DuplicateStatus", "DuplicateOf"]
+    CATEGORY_COLUMN = 'H'
+    MAX_CELL_LENGTH = 32767  # Excel's limit; longer text corrupts the file
 
-    # Extract images if they exist
-    if group['image_page'] is not None:
-        img_path = extract_and_save_images(pdf_path, group['image_page'])
-        question_data['QuestionImage'] = img_path or 'null'
-    
-    if group['explanation_page'] is not None:
-        exp_page = pages[group['explanation_page']]
-        if len(exp_page.images) > 0:
-            img_path = extract_and_save_images(pdf_path, group['explanation_page'])
-            question_data['ExplanationImage'] = img_path or 'null'
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Questions")
+        self.sheet.append(self.HEADERS)
 
-    
-    
-    # Extract correct answer from answer page
-    if group['answer_page'] is not None:
-        answer_page_text = pages[group['answer_page']].extract_text()
-        
-        # Extract correct answer letter (A/B/C/D/E)
-        correct_answer_letter = extract_correct_answer_letter(answer_page_text, options)
-        question_data['CorrectAnswer'] = correct_answer_letter
-    
-    return question_data
+    @classmethod
+    def cell(cls, value):
+        """Text with the control characters openpyxl rejects removed, cut to Excel's limit"""
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 
-# def generate_excel(question_data: List[Dict], output_file: str = "questions_output.xlsx"):
-#     """
-#     Generate Excel file from extracted questions
-#     """
-#     wb = openpyxl.Workbook()
-#     ws = wb.active
-#     ws.title = "Questions"
-
-#     # Headers
-#     headers = ["Question", "OptionA", "OptionB", "OptionC", "OptionD", "OptionE", 
-#                "CorrectAnswer", "Category", "Explanation", "QuestionImage", "ExplanationImage", 
-#                "ImageCheck"]
-#     ws.append(headers)
-
-#     # Add questions with hyperlinks
-#     for idx, q in enumerate(question_data, start=2):  # Start at row 2 (after header)
-#         row = [
-#             q['Question'],
-#             q['OptionA'],
-#             q['OptionB'],
-#             q['OptionC'],
-#             q['OptionD'],
-#             q['OptionE'],
-#             q['CorrectAnswer'],
-#             q['Category'],
-#             q['Explanation'],
-#             q['QuestionImage'],
-#             q['ExplanationImage'],
-#             f"Q:{q['QuestionImage'] != 'null'} | E:{q['ExplanationImage'] != 'null'}"
-#         ]
-#         ws.append(row)
-#     
-#     categories_sheet = wb.create_sheet("Categories")
-#     categories = [
-#         "Cardiology",
-#         "MajorTrauma", 
-#         "MinorTrauma", 
-#         "Pediatrics", 
-#         "Toxicology",
-#         "Resuscitation", 
-#         "Eye", 
-#         "ENT", 
-#         "ObstetricAndGynaecology", 
-#         "PainAndSedation",
-#         "Nephrology", 
-#         "Neurology", 
-#         "Gastroenterology", 
-#         "EnvironmentalEmergencies",
-#         "ElderlyCare", 
-#         "Dermatology", 
-#         "Allergy", 
-#         "OncologicalEmergencies",
-#         "Musculoskeletal", 
-#         "Respiratory", 
-#         "SurgicalEmergencies", 
-#         "Urology",
-#         "Vascular", 
-#         "Endocrinology", 
-#         "Haemotology", 
-#         "InfectiousDiseases",
-#         "ProceduralSkills", 
-#         "ComplexOrChallengingSituations"
-#     ]
-#     for cat in categories:
-#         categories_sheet.append([cat])
-#     
-#     # Add dropdown validation to Category column (Column H)
-#     dv = DataValidation(type="list", formula1="=Categories!$A$1:$A$28", allow_blank=True)
-#     dv.add(f"H2:H{len(question_data) + 1}")  # H is Category column
-#     ws.add_data_validation(dv)
+        if isinstance(value, str):
+            return ILLEGAL_CHARACTERS_RE.sub('', value)[:cls.MAX_CELL_LENGTH]
+        return value
+
+    def write(self, item: Dict):
+        choices = item['choices']
+        question_image = item['image_url'] or 'null'
+        explanation_image = item['explanation_image_url'] or 'null'
+        row = [
+            item['question_text'],
+            *(choices.get(letter, '') for letter in OPTION_LETTERS),
+            item['correct_answer'],
+            item['category'],
+            item['explanation'],
+            question_image,
+            explanation_image,
+            f"Q:{question_image != 'null'} | E:{explanation_image != 'null'}",
+            item.get('answer_confidence'),
+            item.get('duplicate_status'),  # Only with --dedupe-index
+            item.get('duplicate_of'),
+        ]
+        self.sheet.append([self.cell(value) for value in row])
+        self.count += 1
+
+    def close(self):
+        categories = list(CATEGORY_MAP.values())
+        categories_sheet = self.workbook.create_sheet("Categories")
+        for category in categories:
+            categories_sheet.append([category])
+
+        # Dropdown on the Category column
+        if self.count:
+            dv = DataValidation(type="list", formula1=f"=Categories!$A$1:$A${len(categories)}", allow_blank=True)
+            dv.add(f"{self.CATEGORY_COLUMN}2:{self.CATEGORY_COLUMN}{self.count + 1}")
+            self.sheet.data_validations.append(dv)
+        self.workbook.save(self.f)
 
-#     wb.save(output_file)
-#     print(f"✓ Excel file saved: {output_file}")
 
-def generate_json(questions_data: List[Dict], output_file: str = "questions_output.json"):
+# Plan levels the backend accepts (VALID_PLAN_LEVELS in question-validators.ts)
+PLAN_LEVELS = ('Primary', 'Intermediate')
+
+
+class PostgresCopyWriter:
+    """
+    Writes the rows of COPY questions (...) FROM STDIN in PostgreSQL's text
+    format, one line per question, so a bank can be bulk loaded in one
+    statement instead of a multi-row INSERT with a parameter per value
+    Columns follow the questions table in backend/src/db/schema.ts; id and
+    the timestamps take their defaults, plan_level (NOT NULL, no default)
+    is the same for the whole file. NUL characters are dropped, neither
+    text nor jsonb columns can store them. Image columns hold what the JSON
+    would: local paths unless --publish has uploaded the images
+    """
+    binary = True  # Rows must end in a bare '\n' on every platform
+    TABLE = 'questions'
+    COLUMNS = ('question_text', 'choices', 'correct_answer', 'category', 'plan_level',
+               'explanation', 'image_url', 'explanation_image_url')
+    OPTIONS = ''  # Text format defaults: tab delimiter, \N for NULL
+    DELIMITER = '\t'
+
+    def __init__(self, f, plan_level: Optional[str] = None):
+        if plan_level not in PLAN_LEVELS:
+            raise ValueError(f"COPY output needs a plan level, one of: {', '.join(PLAN_LEVELS)}")
+        self.f = f
+        self.count = 0
+        self.plan_level = plan_level
+
+    @classmethod
+    def statement(cls) -> str:
+        """The COPY command that loads this writer's output"""
+        return f"COPY {cls.TABLE} ({', '.join(cls.COLUMNS)}) FROM STDIN{cls.OPTIONS}"
+
+    @classmethod
+    def field(cls, value: Optional[str]) -> str:
+        if value is None:
+            return '\\N'
+        # Chained replace() runs about twice as fast as str.translate here
+        return (value.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
+                .replace('\t', '\\t').replace('\0', ''))
+
+    def row(self, item: Dict) -> tuple:
+        """Column values of a formatted question, in COLUMNS order"""
+        choices = {letter: text.replace('\0', '') for letter, text in item['choices'].items()}
+        return (item['question_text'], json.dumps(choices, ensure_ascii=False), item['correct_answer'],
+                item['category'], self.plan_level, item['explanation'], item['image_url'],
+                item['explanation_image_url'])
+
+    def write(self, item: Dict):
+        line = self.DELIMITER.join(self.field(value) for value in self.row(item)) + '\n'
+        self.f.write(line.encode('utf-8'))
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+class PostgresCsvWriter(PostgresCopyWriter):
+    """
+    PostgresCopyWriter in COPY's CSV format: every string is quoted, so an
+    unquoted empty field is NULL and "" an empty string
+    """
+    OPTIONS = ' WITH (FORMAT csv)'
+    DELIMITER = ','
+
+    @classmethod
+    def field(cls, value: Optional[str]) -> str:
+        if value is None:
+            return ''
+        return '"' + value.replace('\0', '').replace('"', '""') + '"'
+
+
+OUTPUT_WRITERS = {
+    'json': JsonArrayWriter,
+    'jsonl': JsonLinesWriter,
+    'xlsx': ExcelWriter,
+    'pgcopy': PostgresCopyWriter,
+    'pgcsv': PostgresCsvWriter,
+}
+
+# Formats loaded with COPY; their writers take the plan level
+COPY_FORMATS = ('pgcopy', 'pgcsv')
+
+
+def write_questions(questions: Iterable[QuestionRecord], output_file: str, fmt: str = 'json',
+                    **writer_options) -> int:
+    """
+    Format and write questions as they arrive, flushing each one to disk
+    The output is built in a temp file next to output_file and renamed
+    into place when complete, so it never exists half written
+    writer_options go to the format's writer (plan_level for COPY formats)
+    Returns the number of questions written
+    """
+    import os
+
+    writer_class = OUTPUT_WRITERS[fmt]
+    tmp = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        with (open(tmp, 'wb') if getattr(writer_class, 'binary', False) else
+              open(tmp, 'w', encoding='utf-8')) as f:
+            writer = writer_class(f, **writer_options)
+            for q in questions:
+                writer.write(format_question(q))
+                f.flush()
+            writer.close()
+        os.replace(tmp, output_file)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return writer.count
+
+
+def generate_json(questions_data: Iterable[QuestionRecord], output_file: str = "questions_output.json",
+                  fmt: str = 'json'):
     """
     Generate JSON file from extracted questions
     Format for direct database import
+    questions_data may be a QuestionStore, a list or a generator (streaming mode);
+    fmt is 'json' (array) or 'jsonl' (one question per line)
     """
-    import json
-    
-    formatted_questions = []
-    
-    for q in questions_data:
-        # Format choices as simple dict
-        choices = {
-            "A": q['OptionA'],
-            "B": q['OptionB'],
-            "C": q['OptionC'],
-            "D": q['OptionD'],
-            "E": q['OptionE']
-        }
-        
-        # Remove empty options
-        choices = {k: v for k, v in choices.items() if v}
-        
-        formatted_q = {
-            "question_text": q['Question'],
-            # "question_type": "radiogroup",
-            "choices": choices,
-            "correct_answer": q['CorrectAnswer'],
-            "category": q['Category'],
-            "explanation": q['Explanation'],
-            "image_url": q['QuestionImage'] if q['QuestionImage'] != 'null' else None,
-            "explanation_image_url": q['ExplanationImage'] if q['ExplanationImage'] != 'null' else None
-        }
-        
-        formatted_questions.append(formatted_q)
-    
-    # Write to JSON file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(formatted_questions, f, indent=2, ensure_ascii=False)
-    
+    count = write_questions(questions_data, output_file, fmt)
+
     print(f"JSON file saved: {output_file}")
-    print(f"Total questions: {len(formatted_questions)}")
+    print(f"Total questions: {count}")
+    return count
+
+
+def generate_excel(questions_data: Iterable[QuestionRecord], output_file: str = "questions_output.xlsx"):
+    """
+    Generate the Excel review sheet from extracted questions
+    Streamed like generate_json: questions_data may be a generator
+    """
+    count = write_questions(questions_data, output_file, 'xlsx')
+
+    print(f"Excel file saved: {output_file}")
+    print(f"Total questions: {count}")
+    return count
+
+
+def generate_copy(questions_data: Iterable[QuestionRecord], output_file: str, fmt: str = 'pgcopy',
+                  plan_level: Optional[str] = None):
+    """
+    Generate a PostgreSQL COPY file from extracted questions
+    Streamed like generate_json; prints the COPY command that loads it
+    """
+    count = write_questions(questions_data, output_file, fmt, plan_level=plan_level)
+
+    print(f"COPY file saved: {output_file}")
+    print(f"Total questions: {count}")
+    print(f"Load with: psql -c \"{OUTPUT_WRITERS[fmt].statement()}\" < {output_file}")
+    return count
+
+
+def generate_output(questions_data: Iterable[QuestionRecord], output_file: str, fmt: str = 'json',
+                    plan_level: Optional[str] = None):
+    """Write questions in the requested --format"""
+    if fmt == 'xlsx':
+        return generate_excel(questions_data, output_file)
+    if fmt in COPY_FORMATS:
+        return generate_copy(questions_data, output_file, fmt, plan_level)
+    return generate_json(questions_data, output_file, fmt)
 
 # def extract_correct_answer(page) -> str:
 #     """
@@ -475,53 +2924,129 @@ def generate_json(questions_data: List[Dict], output_file: str = "questions_outp
     
 #     return ""  # No match found
 
-def extract_correct_answer_letter(page_text: str, options: Dict[str, str]) -> str:
+# Answer matching: options and answer text are compared after normalization,
+# so ligatures, line-break hyphenation, case and spacing don't break a match
+HYPHEN_BREAK_RE = re.compile(r'(\w)-\s+(\w)')  # "thora- cotomy" from a wrapped line
+TOKEN_RE = re.compile(r'\w+')
+MIN_TOKEN_SIMILARITY = 0.5  # Jaccard overlap below this is not a match
+
+
+def normalize_answer_text(text: str) -> str:
+    """NFKC (expands ligatures), join hyphenated line breaks, casefold, collapse whitespace"""
+    import unicodedata
+
+    text = unicodedata.normalize('NFKC', text)
+    text = HYPHEN_BREAK_RE.sub(r'\1\2', text)
+    return ' '.join(text.casefold().split())
+
+
+class OptionIndex:
     """
-    Extract correct answer LETTER from answer page
-    Answer page shows only the correct answer text
-    Match it against options to find which letter (A/B/C/D/E)
+    Normalized option strings and token sets for one question, built once
+    resolve() scores every option in a single pass: exact match, then
+    containment (either way), then token overlap
     """
-    lines = page_text.strip().split('\n')
-    first_line = lines[0].strip() if lines else ""
-    
-    # First, try to extract letter directly from start (e.g., "C. Emergency thoracotomy")
-    match = re.match(r'^([A-Ea-e])[\.\)]\s*', first_line)
-    if match:
-        return match.group(1).upper()
-    
-    # Fallback: Get text before category key and match against options
+    __slots__ = ('letters', 'texts', 'tokens')
+
+    def __init__(self, options: Dict[str, str], normalize=normalize_answer_text):
+        self.letters = [letter for letter, text in options.items() if text]
+        self.texts = [normalize(options[letter]) for letter in self.letters]
+        self.tokens = [frozenset(TOKEN_RE.findall(text)) for text in self.texts]
+
+    def resolve(self, answer: str) -> tuple:
+        """(letter, confidence 0-1) for normalized answer text; ('', 0.0) if nothing matches"""
+        if not answer:
+            return '', 0.0
+        answer_tokens = frozenset(TOKEN_RE.findall(answer))
+        padded_answer = f' {answer} '
+        best_letter, best_score = '', 0.0
+        for letter, text, tokens in zip(self.letters, self.texts, self.tokens):
+            if not text:
+                continue
+            if text == answer:
+                return letter, 1.0
+            if f' {text} ' in padded_answer or padded_answer in f' {text} ':
+                # Whole-word containment; closer lengths mean less surrounding noise
+                score = 0.6 + 0.35 * min(len(text), len(answer)) / max(len(text), len(answer))
+            elif tokens and answer_tokens:
+                overlap = len(tokens & answer_tokens) / len(tokens | answer_tokens)
+                score = 0.8 * overlap if overlap >= MIN_TOKEN_SIMILARITY else 0.0
+            else:
+                score = 0.0
+            if score > best_score:
+                best_letter, best_score = letter, score
+        return best_letter, round(best_score, 3)
+
+
+# Normalized strings an AnswerMatcher remembers; option texts repeat within
+# a bank (True/False, "All of the above"), most others are seen once
+ANSWER_NORMALIZE_CACHE = 4096
+
+
+class AnswerMatcher:
+    """
+    Batch answer resolution for one document
+    One matcher is shared by every question of an extraction, but each
+    answer is still resolved as its question is extracted so --stream and
+    checkpoints keep working; there is no separate all-at-once pass
+    Normalized strings are memoized in a bounded LRU cache, so option texts
+    repeated across questions are normalized once while memory stays flat
+    however large the bank
+    """
+
+    def __init__(self, cache_size: int = ANSWER_NORMALIZE_CACHE):
+        import functools
+
+        self.normalize = functools.lru_cache(maxsize=cache_size)(normalize_answer_text)
+
+    def resolve(self, options: Dict[str, str], answer: str) -> tuple:
+        return OptionIndex(options, self.normalize).resolve(self.normalize(answer))
+
+
+def answer_page_text(page_text) -> str:
+    """Answer page text before the category key, skipping noise lines"""
+    model = as_page_model(page_text)
     answer_text = []
-    for line in lines:
-        line = line.strip()
-        if re.match(r'^[A-Z][a-z]$', line) or re.match(r'^[A-Z]{2}$', line):
+    for line, kind in zip(model.lines, model.kinds):
+        if kind == LINE_CATEGORY_KEY:
             break
-        if line and len(line) > 2:
+        if len(line) > 2:
             answer_text.append(line)
-    
-    answer = ' '.join(answer_text).strip()
-    
-    # Match against options to find which letter
-    for letter, option_text in options.items():
-        if option_text.lower() in answer.lower() or answer.lower() in option_text.lower():
-            return letter
-    
-    return ""  # No match found
+    return ' '.join(answer_text).strip()
 
-def extract_category_key(page_text: str) -> str:
+
+def resolve_correct_answer(page_text, options: Dict[str, str],
+                           matcher: Optional[AnswerMatcher] = None) -> tuple:
+    """
+    (letter, confidence) for an answer page; see extract_correct_answer_letter
+    A lettered answer ("C. Emergency thoracotomy") is taken as is
+    """
+    model = as_page_model(page_text)
+
+    # First, try to extract letter directly from start (e.g., "C. Emergency thoracotomy")
+    if model.kinds[0] == LINE_OPTION:
+        return model.lines[0][0].upper(), 1.0
+
+    # Fallback: Get text before category key and match against options
+    return (matcher or AnswerMatcher()).resolve(options, answer_page_text(model))
+
+
+def extract_correct_answer_letter(page_text, options: Dict[str, str]) -> str:
+    """
+    Extract correct answer LETTER from answer page
+    Answer page shows only the correct answer text
+    Match it against options to find which letter (A/B/C/D/E)
+    Accepts page text or a PageModel
+    """
+    return resolve_correct_answer(page_text, options)[0]
+
+def extract_category_key(page_text) -> str:
     """
     Extract 2-letter category key from bottom of answer page
     Returns key like "Ca", "Ma", "RE", "EN", etc.
+    Accepts page text or a PageModel
     """
-    lines = page_text.strip().split('\n')
-    
-    # Category key is at the bottom, look from end
-    for line in reversed(lines):
-        line = line.strip()
-        # Match 2 letters (mixed case, e.g., Ma, Ga, Ca)
-        if re.match(r'^[A-Z][a-z]$', line) or re.match(r'^[A-Z]{2}$', line):
-            return line
-    
-    return ""  # No category key found
+    return as_page_model(page_text).category_key
 
 CATEGORY_MAP = {
     "ca": "Cardiology",
@@ -562,27 +3087,659 @@ def map_category(key: str) -> str:
     # Convert to lowercase for case-insensitive lookup
     return CATEGORY_MAP.get(key.lower(), "")
 
-# Update test
-if __name__ == '__main__':
-    import sys
-    sys.stdout.reconfigure(encoding='utf-8')
-    
+def parse_page_range(spec: str) -> tuple:
+    """--pages value: 'START-END', 'START-' or 'N' (1-based, inclusive) -> (start index, stop index or None)"""
+    import argparse
+
+    match = re.fullmatch(r'\s*(\d+)\s*(?:(-)\s*(\d*)\s*)?', spec)
+    if not match or int(match.group(1)) < 1:
+        raise argparse.ArgumentTypeError(f"invalid page range {spec!r}, expected START-END, START- or N")
+    start = int(match.group(1))
+    if match.group(2) is None:
+        end = start
+    else:
+        end = int(match.group(3)) if match.group(3) else None
+    if end is not None and end < start:
+        raise argparse.ArgumentTypeError(f"page range {spec!r} ends before it starts")
+    return start - 1, end
+
+
+def parse_args(argv=None):
+    """Command line options"""
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Extract questions from a structured question bank PDF")
     # Accept PDF path and optional output path from command line arguments
-    pdf_path = sys.argv[1] if len(sys.argv) > 1 else "sample_questions.pdf"
-    output_path = sys.argv[2] if len(sys.argv) > 2 else "questions_output.json"
-    
-    pages = extract_pages(pdf_path)
-        
-    if pages:
-        question_groups = group_question_pages(pages)
+    parser.add_argument('pdf_path', nargs='?', default="sample_questions.pdf")
+    parser.add_argument('output_path', nargs='?', default="questions_output.json")
+    parser.add_argument('--parallel', action='store_true',
+                        help="Classify and extract page text across a process pool")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes for --parallel or --batch (default: CPU count)")
+    parser.add_argument('--probe', action='store_true',
+                        help="Classify pages from cheap PyMuPDF word boxes and run full text "
+                             "extraction only on question, answer and explanation pages")
+    parser.add_argument('--stream', action='store_true',
+                        help="Read pages lazily and write each question as soon as it is extracted")
+    parser.add_argument('--pages', type=parse_page_range, metavar='START-END',
+                        help="Only extract questions starting on these pages (1-based, inclusive; 'START-' "
+                             "runs to the end); implies streaming and bypasses the extraction cache")
+    parser.add_argument('--preview', type=int, metavar='N',
+                        help="Stop as soon as N complete questions have been extracted (for checking a "
+                             "parse before the full run); implies streaming and bypasses the extraction cache")
+    parser.add_argument('--page-index', action='store_true',
+                        help="Save the question boundaries found to PDF.pages.json, which --pages uses to "
+                             "start on a question's first page (--pages and --preview always update it)")
+    parser.add_argument('--format', choices=sorted(OUTPUT_WRITERS), default='json',
+                        help="Output format: JSON array (default), JSON Lines, the xlsx review sheet, or "
+                             "rows for PostgreSQL COPY into the questions table in text (pgcopy) or CSV (pgcsv) format")
+    parser.add_argument('--plan-level', choices=PLAN_LEVELS,
+                        help="plan_level of every question, required by --format pgcopy/pgcsv")
+    parser.add_argument('--backend', choices=sorted(TEXT_BACKENDS), default='pdfplumber',
+                        help="Page text extraction backend: pdfplumber (default) or the much faster PyMuPDF")
+    parser.add_argument('--publish', metavar='TARGET',
+                        help="Run the concurrent parse/encode/upload pipeline and publish images to TARGET: "
+                             "a directory, or an http(s) URL images are PUT under; the output holds final URLs")
+    parser.add_argument('--publish-base-url', metavar='URL',
+                        help="Public URL prefix for published images (default: file:// or the PUT URL)")
+    parser.add_argument('--publish-header', action='append', default=[], metavar='"NAME: VALUE"',
+                        help="Extra HTTP header for --publish uploads, e.g. authorization (repeatable)")
+    parser.add_argument('--publish-concurrency', type=int, default=4,
+                        help="Image uploads in flight at once (default: 4)")
+    parser.add_argument('--pipeline-queue-size', type=int, default=8,
+                        help="Questions buffered between --publish pipeline stages (default: 8)")
+    parser.add_argument('--job-id',
+                        help="Write images to their own workspace, extracted_images/JOB_ID/, named by "
+                             "content hash, so concurrent runs never overwrite each other")
+    parser.add_argument('--checkpoint', action='store_true',
+                        help="Journal finished pages and questions in the job workspace; re-running the "
+                             "same --job-id resumes where a crashed or timed-out run stopped")
+    parser.add_argument('--workspace-ttl', type=float, default=24 * 3600, metavar='SECONDS',
+                        help="Remove job workspaces (except --batch ones) untouched for this long "
+                             "(default: 1 day, 0 disables)")
+    parser.add_argument('--image-format', choices=list(IMAGE_FORMATS), default='original',
+                        help="Re-encode extracted images (needs Pillow); 'original' keeps the source "
+                             "format, converting ones browsers can't show to PNG")
+    parser.add_argument('--max-image-dimension', type=int, metavar='PX',
+                        help="Downscale images whose width or height exceeds PX (needs Pillow)")
+    parser.add_argument('--image-quality', type=int, default=85,
+                        help="JPEG/WebP quality when re-encoding (default: 85)")
+    parser.add_argument('--all-images', action='store_true',
+                        help="Extract every image of a page and add image_urls/explanation_image_urls lists")
+    parser.add_argument('--dedupe-distance', type=int, metavar='BITS',
+                        help="Also reuse a saved image whose perceptual hash is within BITS of 64 "
+                             "(e.g. 4; needs Pillow). Identical images are always deduplicated")
+    parser.add_argument('--dedupe-index', metavar='PATH',
+                        help="Flag each question as new, exact or near duplicate of any question in this "
+                             "persistent index (SQLite, created if missing), then add the new ones to it")
+    parser.add_argument('--dedupe-threshold', type=float, default=0.8,
+                        help="Estimated text similarity from which a question is a near duplicate (default: 0.8)")
+    parser.add_argument('--shards', metavar='DIR',
+                        help="Also write one compressed file per category and a manifest.json (counts, block "
+                             "offsets, sha256/ETag) for static serving, with images copied to DIR/images; "
+                             "unchanged categories are not rewritten, ones missing from this PDF are kept")
+    parser.add_argument('--shards-prune', action='store_true',
+                        help="Remove the shards of categories this PDF has no questions in")
+    parser.add_argument('--shard-compression', choices=sorted(SHARD_EXTENSIONS), default='gzip',
+                        help="Shard compression (default: gzip; zstd needs the zstandard package)")
+    parser.add_argument('--cache-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.extraction_cache'),
+                        help="Extraction result cache location (default: scripts/.extraction_cache)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Bypass the extraction result cache")
+    parser.add_argument('--cache-max-bytes', type=int, default=1 << 30,
+                        help="Evict least recently used cache entries beyond this size (default: 1 GiB)")
+    parser.add_argument('--progress', metavar='DEST',
+                        help="Write JSON Lines progress events to DEST: '-' (stderr), 'fd:N' or a file path")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="Profile the run and write the result to PATH")
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile',
+                        help="cprofile writes pstats data, pyinstrument (if installed) an HTML report")
+    parser.add_argument('--batch', metavar='SOURCE',
+                        help="Extract every PDF in a directory, or listed in a manifest file, across "
+                             "--workers processes (positional paths are ignored)")
+    parser.add_argument('--output-dir', default='batch_output',
+                        help="Per-document outputs, logs and batch_summary.json for --batch")
+    parser.add_argument('--combine', metavar='PATH',
+                        help="Also merge all --batch outputs into one file (questions tagged with source_pdf)")
+    parser.add_argument('--serve', action='store_true',
+                        help="Run as a persistent worker reading JSON-RPC jobs from stdin (see serve())")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="Jobs run at the same time in --serve mode")
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help="Jobs allowed to wait for a free worker in --serve mode before new ones are rejected")
+    args = parser.parse_args(argv)
+    if (args.pages or args.preview is not None) and (args.parallel or args.probe or args.checkpoint or args.batch):
+        parser.error("--pages and --preview stream the selected pages; they cannot be combined with "
+                     "--parallel, --probe, --checkpoint or --batch")
+    if args.preview is not None and args.preview < 1:
+        parser.error("--preview needs at least 1 question")
+    if args.stream and args.parallel:
+        parser.error("--stream and --parallel cannot be combined")
+    if args.stream and args.probe:
+        parser.error("--stream and --probe cannot be combined")
+    if args.publish and (args.parallel or args.probe):
+        parser.error("--publish runs its own streaming pipeline; it cannot be combined with --parallel or --probe")
+    if args.batch and (args.parallel or args.serve or args.job_id or args.profile):
+        parser.error("--batch runs one document per worker; it cannot be combined with "
+                     "--parallel, --serve, --job-id or --profile")
+    if not 0 < args.dedupe_threshold <= 1:
+        parser.error("--dedupe-threshold must be in (0, 1]")
+    if args.combine and args.format not in ('json', 'jsonl'):
+        parser.error("--combine merges JSON outputs; use --format json or jsonl")
+    if args.batch and args.shards:
+        parser.error("--shards describes one question bank; it cannot be combined with --batch")
+    if args.shards_prune and not args.shards:
+        parser.error("--shards-prune needs --shards")
+    if args.format in COPY_FORMATS and args.plan_level is None:
+        parser.error(f"--format {args.format} needs --plan-level (plan_level is NOT NULL)")
+    if args.checkpoint and args.job_id is None and not args.batch:
+        parser.error("--checkpoint needs a --job-id to resume by")
+    if args.job_id is not None and not JOB_ID_RE.match(args.job_id):
+        parser.error("--job-id may only contain letters, digits, '_', '-' and '.'")
+    return args
+
+
+def run_extraction(args) -> int:
+    """
+    Run one extraction job described by parsed command line options
+    Returns the number of questions written
+    """
+    if args.workspace_ttl > 0:
+        cleanup_workspaces(args.workspace_ttl)
+
+    progress = open_progress_stream(args.progress) if args.progress else None
+    instrumentation.reset(progress)
+    instrumentation.emit('start', pdf=args.pdf_path, output=args.output_path)
+    try:
+        count = _run_extraction(args)
+    except Exception as e:
+        instrumentation.emit('error', message=str(e))
+        raise
+    finally:
+        summary = instrumentation.finish()
+        if progress is not None and args.progress != '-':
+            progress.close()
+
+    stages = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in summary['stages'].items())
+    print(f"Timing: {summary['total_seconds']:.2f}s total ({stages})")
+    return count
+
+
+def _run_extraction(args) -> int:
+    pdf_path = args.pdf_path
+    # --probe may group pages differently, so its results get keys of their own
+    salt = ImageOptions.from_args(args).cache_salt() + (':probe' if args.probe else '')
+
+    cache = None
+    # Partial runs must not become the document's cache entry, and hashing
+    # every page for the page store would cost more than the preview itself
+    if not args.no_cache and args.pages is None and args.preview is None:
+        try:
+            cache = ExtractionCache(args.cache_dir, args.cache_max_bytes)
+            cache_key = cache.document_key(pdf_path, salt, args.backend)
+            cached = cache.load(cache_key, job_output_dir(args.job_id))
+        except OSError as e:
+            print(f"Warning: Extraction cache unavailable: {e}")
+            cache = None
+        else:
+            if cached is not None:
+                print(f"Cache hit: reusing extraction for {pdf_path}")
+                with open_pdf(pdf_path, 'pymupdf') as pdf:
+                    instrumentation.document_cached(document_page_count(pdf))
+                if args.publish:
+                    import asyncio
+
+                    with instrumentation.stage('publish'):
+                        cached = asyncio.run(publish_questions(cached, make_publisher(args), args.pipeline_queue_size))
+                with instrumentation.stage('write'):
+                    return write_output(args, cached)
+
+    page_store = None
+    if cache is not None:
+        import sqlite3
+
+        try:
+            page_store = cache.page_store(pdf_path, args.backend)
+        except sqlite3.OperationalError as e:
+            print(f"Warning: Page store unavailable: {e}")
+    checkpoint = None
+    try:
+        if args.checkpoint:
+            checkpoint = Checkpoint(
+                Path(_image_output_dir(job_output_dir(args.job_id))) / 'checkpoint.jsonl',
+                ExtractionCache.document_key(pdf_path, salt, args.backend),
+                page_store,
+            )
+            print(f"Checkpoint: resuming with {len(checkpoint.pages)} pages, "
+                  f"{len(checkpoint.questions)} questions done")
+        questions = extract_questions(args, checkpoint or page_store, checkpoint)
+        if cache is not None and not args.publish:  # Published URLs depend on the destination
+            questions = cache.record(cache_key, questions)
+        # In streaming mode extraction happens lazily inside this stage
+        with instrumentation.stage('write' if not args.stream else 'stream'):
+            return write_output(args, questions)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if page_store is not None:
+            print(f"Page store: {page_store.hits} pages reused, {page_store.misses} parsed")
+            page_store.close()
+        if cache is not None:
+            try:
+                cache.evict()
+            except Exception as e:
+                print(f"Warning: Cache eviction failed: {e}")
+
+
+def write_output(args, questions: Iterable[QuestionRecord]) -> int:
+    """
+    Write the job's output, flagging duplicates first with --dedupe-index
+    and building category shards alongside it with --shards
+    """
+    source = Path(args.pdf_path).name
+    index = DuplicateIndex(args.dedupe_index, args.dedupe_threshold, source) if args.dedupe_index else None
+    shards = ShardBuilder(args.shards, args.shard_compression, source, args.shards_prune) if args.shards else None
+    try:
+        if index is not None:
+            questions = index.flag(questions)
+        if shards is not None:
+            questions = shards.collect(questions)
+        count = generate_output(questions, args.output_path, args.format, args.plan_level)
+        if shards is not None:
+            stats = shards.build()
+            print(f"Shards saved: {args.shards} ({len(shards.manifest['categories'])} categories; "
+                  f"{stats['written']} written, {stats['kept']} kept, {stats['removed']} removed)")
+        if index is not None:
+            index.commit()  # Only once the output is complete
+    finally:
+        if index is not None:
+            index.close()
+    if index is not None:
+        print(f"Duplicates: {index.counts[DUPLICATE_NEW]} new, {index.counts[DUPLICATE_EXACT]} exact, "
+              f"{index.counts[DUPLICATE_NEAR]} near")
+    return count
+
+
+def make_publisher(args) -> ImagePublisher:
+    """ImagePublisher for the --publish options"""
+    return ImagePublisher(make_uploader(args.publish, args.publish_base_url, args.publish_header),
+                          args.publish_concurrency)
+
+
+def extract_questions(args, page_store: Optional[PageStore] = None,
+                      checkpoint: Optional[Checkpoint] = None) -> Iterable[QuestionRecord]:
+    """
+    Extracted questions for a job, as a QuestionStore or (streaming mode) a generator
+    page_store may be a Checkpoint, which also replays finished questions
+    """
+    pdf_path = args.pdf_path
+    output_dir = job_output_dir(args.job_id)
+    image_options = ImageOptions.from_args(args)
+    selection = PageSelection.from_args(args)
+
+    if args.publish:
+        import asyncio
+
+        # Parse, encode and upload run concurrently inside this one stage
+        with instrumentation.stage('pipeline'):
+            return asyncio.run(publish_pipeline(pdf_path, make_publisher(args), output_dir, page_store, args.backend,
+                                                image_options, checkpoint, args.pipeline_queue_size, selection))
+
+    # Page ranges and previews always stream, so only the pages they need are opened
+    if args.stream or (selection is not None and selection.partial):
+        return iter_questions(pdf_path, output_dir, page_store, args.backend, image_options, checkpoint, selection)
+
+    with instrumentation.stage('load'):
+        pages = extract_pages(pdf_path, args.backend)
+
+    if args.probe:
+        # Group on cheap probe records, then analyze only the pages extraction reads
+        with instrumentation.stage('probe'):
+            probes = probe_pages(pdf_path)
+            question_groups = group_question_pages(PageCache.from_records(probes))
+            needed = pages_needing_text(question_groups)
+    else:
+        needed = range(len(pages))
+
+    with instrumentation.stage('analyze_pages'):
+        if args.parallel:
+            page_cache = analyze_pages_parallel(pdf_path, len(pages), args.workers, page_store, args.backend, needed)
+        else:
+            page_cache = PageCache(pages, page_store)
+            for index in needed:
+                page_cache[index]
+
+    if args.probe:
+        print(f"Probe: {len(needed)} of {len(pages)} pages needed full text")
+        mismatched = [index for index in needed if page_cache[index].page_type != probes[index].page_type]
+        if mismatched:
+            print(f"Warning: Probe classified pages {mismatched} differently from full text, "
+                  f"re-run without --probe if questions look wrong")
+        page_cache = PageCache.from_records([page_cache.records.get(index) or probes[index]
+                                             for index in range(len(pages))])
+    else:
+        with instrumentation.stage('group_pages'):
+            question_groups = group_question_pages(page_cache)
+
+    if selection is not None:  # --page-index
+        for group in question_groups:
+            selection.offsets.add(group)
+        selection.offsets.save()
 
-        # Extract all questions
-        all_questions = []
+    finished = set(checkpoint.questions) if checkpoint is not None else set()
+
+    # Extract every needed image in one pass over the document
+    with instrumentation.stage('images'):
+        pending = [group for group in question_groups if group['question_page'] not in finished]
+        images = extract_images_batch(pdf_path, collect_image_pages(pending, page_cache),
+                                      output_dir, image_options)
+
+    # Extract all questions
+    all_questions = QuestionStore()
+    matcher = AnswerMatcher()
+    with instrumentation.stage('extract_questions'):
         for idx, group in enumerate(question_groups):
-            q_data = extract_complete_question(pdf_path, pages, group)
+            q_data = checkpoint.question(group) if group['question_page'] in finished else None
+            if q_data is None:
+                q_data = extract_complete_question(pdf_path, page_cache, group, images,
+                                                   image_options.all_images, matcher)
+                if checkpoint is not None:
+                    checkpoint.question_done(group, q_data)
             all_questions.append(q_data)
-        
-        print(f"Extracted {len(all_questions)} questions")
-        
-        # Generate JSON (for backend import)
-        generate_json(all_questions, output_path)
\ No newline at end of file
+            instrumentation.question_done()
+
+    print(f"Extracted {len(all_questions)} questions")
+    stats = page_cache.stats()
+    print(f"Page cache: {stats['misses']} parsed, {stats['hits']} reused")
+    return all_questions
+
+
+def run_job(params: Dict) -> Dict:
+    """
+    Execute one worker job in a pool process
+    params: {"pdf_path": ..., "output_path": ..., "options": ["--format", "jsonl", ...]}
+    Log output goes to stderr so stdout stays a clean response stream
+    """
+    import contextlib
+    import sys
+    import time
+
+    if not params.get('pdf_path') or not params.get('output_path'):
+        raise ValueError("pdf_path and output_path are required")
+
+    argv = [params['pdf_path'], params['output_path']] + list(params.get('options', []))
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            args = parse_args(argv)
+        except SystemExit:
+            raise ValueError(f"Invalid job options: {argv}")
+        if args.serve:
+            raise ValueError("--serve is not allowed inside a job")
+
+        start = time.perf_counter()
+        count = run_extraction(args)
+
+    return {
+        'output_path': args.output_path,
+        'count': count,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def serve(concurrency: int = 1, queue_size: int = 8, stdin=None, stdout=None):
+    """
+    Persistent worker mode: a JSON-RPC style loop over stdin/stdout
+    Dependencies are imported once and pool processes stay warm, so the
+    backend can send many jobs without paying interpreter start-up each time
+
+    Requests, one JSON object per line:
+        {"id": 1, "method": "extract", "params": {"pdf_path": "...", "output_path": "...", "options": []}}
+        {"id": 2, "method": "ping"}
+        {"id": 3, "method": "shutdown"}
+    Responses, one JSON object per line, possibly out of order:
+        {"id": 1, "result": {"output_path": "...", "count": 12, "seconds": 1.2}}
+        {"id": 1, "error": {"message": "..."}}
+    A job whose PDF is missing, unreadable or has no pages gets an error
+    response and writes no output file
+
+    At most `concurrency` jobs run at once and `queue_size` more may wait;
+    further extract requests are rejected straight away with an error
+    """
+    import contextlib
+    import sys
+    import threading
+    from concurrent.futures import ProcessPoolExecutor
+
+    # PyMuPDF is imported lazily elsewhere, load it before workers fork
+    # (its import can print a notice, keep that off the response stream)
+    with contextlib.redirect_stdout(sys.stderr):
+        import fitz  # noqa: F401
+
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(concurrency + queue_size)
+
+    def respond(message: Dict):
+        with write_lock:
+            stdout.write(json.dumps(message, ensure_ascii=False) + '\n')
+            stdout.flush()
+
+    def job_done(request_id, future):
+        slots.release()
+        try:
+            respond({'id': request_id, 'result': future.result()})
+        except Exception as e:
+            respond({'id': request_id, 'error': {'message': str(e)}})
+
+    print(f"Worker ready (concurrency={concurrency}, queue_size={queue_size})", file=sys.stderr, flush=True)
+
+    with ProcessPoolExecutor(max_workers=concurrency) as pool:
+        for line in iter(stdin.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+                method = request.get('method')
+            except (ValueError, AttributeError) as e:
+                respond({'id': None, 'error': {'message': f"Invalid request: {e}"}})
+                continue
+
+            if method == 'ping':
+                respond({'id': request_id, 'result': 'pong'})
+            elif method == 'shutdown':
+                respond({'id': request_id, 'result': 'bye'})
+                break
+            elif method != 'extract':
+                respond({'id': request_id, 'error': {'message': f"Unknown method: {method}"}})
+            elif not slots.acquire(blocking=False):
+                respond({'id': request_id, 'error': {'message': "Job queue full"}})
+            else:
+                future = pool.submit(run_job, request.get('params') or {})
+                future.add_done_callback(lambda f, request_id=request_id: job_done(request_id, f))
+
+
+def batch_documents(source: str) -> List[Path]:
+    """
+    PDFs for --batch: every *.pdf under a directory, or the paths listed in
+    a manifest file (one per line, relative to the manifest; '#' starts a comment)
+    """
+    source_path = Path(source)
+    if source_path.is_dir():
+        return sorted(path for path in source_path.rglob('*') if path.suffix.lower() == '.pdf' and path.is_file())
+
+    documents = []
+    with open(source_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                documents.append(source_path.parent / line)
+    return documents
+
+
+def _run_batch_document(args) -> Dict:
+    """
+    Batch worker entry point: extract one document
+    Its log goes to a .log file next to its output instead of the console
+    """
+    log_path = Path(args.output_path).with_suffix('.log')
+    start = time.perf_counter()
+    result = {'pdf': args.pdf_path, 'output': args.output_path, 'log': str(log_path)}
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+            result['questions'] = run_extraction(args)
+    except Exception as e:
+        result['error'] = str(e)
+    else:
+        summary = instrumentation.summary()
+        result['pages'] = summary['pages_parsed'] + summary['pages_cached']
+        result['pages_cached'] = summary['pages_cached']
+        result['page_types'] = summary['page_types']
+        result['images_written'] = summary['images_written']
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def combine_outputs(results: List[Dict], output_file: str, fmt: str = 'json') -> int:
+    """
+    Merge per-document outputs into one file, tagging each question with
+    its source PDF; streams one document at a time
+    """
+    with open(output_file, 'w', encoding='utf-8') as f:
+        writer = OUTPUT_WRITERS[fmt](f)
+        for result in results:
+            if 'error' in result:
+                continue
+            with open(result['output'], encoding='utf-8') as source:
+                questions = json.load(source) if fmt == 'json' else map(json.loads, source)
+                for question in questions:
+                    question['source_pdf'] = Path(result['pdf']).name
+                    writer.write(question)
+        writer.close()
+    return writer.count
+
+
+def run_batch(args) -> Dict:
+    """
+    Extract many PDFs across one process pool (--batch)
+    Documents are scheduled largest first so a big bank doesn't start last
+    and hold up the whole run. Each gets its own image workspace
+    (job id batch-<name>, so --checkpoint resumes a re-run; not removed by
+    --workspace-ttl, the outputs reference its images), output file and
+    log in --output-dir; per-document stats go to batch_summary.json
+    """
+    import copy
+    import sys
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # PyMuPDF is imported lazily elsewhere, load it once before workers fork
+    with contextlib.redirect_stdout(sys.stderr):
+        import fitz  # noqa: F401
+
+    documents = sorted(batch_documents(args.batch), key=lambda path: path.stat().st_size, reverse=True)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    extension = f".{args.format}"
+
+    jobs = []
+    names = set()
+    for pdf in documents:
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', pdf.stem)[:100] or 'document'
+        base, suffix = name, 1
+        while name in names:
+            suffix += 1
+            name = f"{base}_{suffix}"
+        names.add(name)
+
+        job_args = copy.copy(args)
+        job_args.pdf_path = str(pdf)
+        job_args.output_path = str(output_dir / f"{name}{extension}")
+        job_args.job_id = f"{BATCH_JOB_PREFIX}{name}"
+        job_args.progress = None
+        jobs.append(job_args)
+
+    print(f"Batch: {len(jobs)} documents, {args.workers} workers")
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(jobs) or 1))) as pool:
+        futures = [pool.submit(_run_batch_document, job_args) for job_args in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            status = f"error: {result['error']}" if 'error' in result else \
+                f"{result['questions']} questions, {result['pages']} pages"
+            print(f"[{done}/{len(jobs)}] {result['pdf']}: {status} ({result['seconds']:.1f}s)")
+
+    results.sort(key=lambda result: result['pdf'])
+    seconds = time.perf_counter() - start
+    pages = sum(result.get('pages', 0) for result in results)
+    summary = {
+        'documents': len(results),
+        'failed': sum('error' in result for result in results),
+        'questions': sum(result.get('questions', 0) for result in results),
+        'pages': pages,
+        'seconds': round(seconds, 3),
+        'pages_per_second': round(pages / seconds, 2) if seconds else 0.0,
+        'results': results,
+    }
+    if args.combine:
+        summary['combined_output'] = args.combine
+        combine_outputs(results, args.combine, args.format)
+
+    with open(output_dir / 'batch_summary.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    print(f"Batch done: {summary['questions']} questions from {summary['documents'] - summary['failed']}"
+          f"/{summary['documents']} documents in {seconds:.1f}s, summary in {output_dir / 'batch_summary.json'}")
+    return summary
+
+
+def run_profiled(args) -> int:
+    """
+    Run an extraction under cProfile or pyinstrument and save the profile
+    """
+    if args.profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Warning: pyinstrument is not installed, falling back to cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                return run_extraction(args)
+            finally:
+                profiler.stop()
+                with open(args.profile, 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+                print(f"Profile saved: {args.profile}")
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(run_extraction, args)
+    finally:
+        profiler.dump_stats(args.profile)
+        print(f"Profile saved: {args.profile}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.concurrency, args.queue_size)
+    elif args.batch:
+        run_batch(args)
+    elif args.profile:
+        run_profiled(args)
+    else:
+        run_extraction(args)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
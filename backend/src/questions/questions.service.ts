@@ -4,6 +4,7 @@ import { questions } from '../db/schema';
 import { CreateQuestionDto } from './dto/create-question.dto';
 import { exec } from 'child_process';
 import { promisify } from 'util';
+import { randomUUID } from 'crypto';
 import * as fs from 'fs/promises';
 import * as path from 'path';
 import { UploadPdfResponseDto } from './dto/upload-pdf.dto';
@@ -11,6 +12,18 @@ import { createClient } from '@supabase/supabase-js';
 
 const execAsync = promisify(exec);
 
+// Extracted image file extension -> upload content type
+const IMAGE_CONTENT_TYPES: Record<string, string> = {
+  '.png': 'image/png',
+  '.jpg': 'image/jpeg',
+  '.jpeg': 'image/jpeg',
+  '.gif': 'image/gif',
+  '.webp': 'image/webp',
+};
+
+// Image fields already published by the script's --publish pipeline
+const isUrl = (value: string) => /^https?:\/\//.test(value);
+
 @Injectable()
 export class QuestionsService {
   private supabase: any;
@@ -64,6 +77,9 @@ export class QuestionsService {
 
     // Unique output JSON path per upload — avoids stale results from previous runs
     const jsonPath = path.join(tempDir, `${timestamp}_questions_output.json`);
+    // Per-upload image workspace (scripts/extracted_images/<jobId>/) so
+    // concurrent uploads never overwrite or delete each other's images
+    const jobId = `${timestamp}_${randomUUID()}`;
 
     try {
       // Check if script exists
@@ -74,9 +90,29 @@ export class QuestionsService {
       }
 
       const pythonExe = path.join(process.cwd(), 'venv', 'Scripts', 'python.exe');
-      const { stdout, stderr } = await execAsync(
-        `"${pythonExe}" "${scriptPath}" "${pdfPath}" "${jsonPath}"`,
-      );
+      // Checkpointed: a retry with the same job id resumes where the failed
+      // run (e.g. killed by a timeout) stopped instead of starting over
+      const command = `"${pythonExe}" "${scriptPath}" "${pdfPath}" "${jsonPath}" --job-id ${jobId} --checkpoint`;
+      let result: { stdout: string; stderr: string };
+      for (let attempt = 1; ; attempt++) {
+        try {
+          result = await execAsync(command);
+          break;
+        } catch (error: any) {
+          // Only a run stopped by a timeout or the output limit can make
+          // progress when resumed; a script error would just fail again
+          const interrupted =
+            error.killed ||
+            error.signal ||
+            error.code === 'ERR_CHILD_PROCESS_STDIO_MAXBUFFER';
+          if (attempt >= 2 || !interrupted) throw error;
+          console.warn(
+            `PDF extraction attempt ${attempt} was interrupted, resuming:`,
+            error.message,
+          );
+        }
+      }
+      const { stdout, stderr } = result;
 
       console.log('Python output:', stdout);
       if (stderr && stderr.includes('Error')) {
@@ -110,15 +146,23 @@ export class QuestionsService {
       }
 
       // 4. Upload images and replace paths
+      // Deduplicated images are shared between questions; upload each file once
+      const uploads = new Map<string, Promise<string>>();
+      const upload = (imagePath: string) => {
+        if (!uploads.has(imagePath)) {
+          uploads.set(imagePath, this.uploadImageToSupabase(imagePath));
+        }
+        return uploads.get(imagePath)!;
+      };
       for (const question of questions) {
-        if (question.image_url) {
+        if (question.image_url && !isUrl(question.image_url)) {
           const imagePath = path.join(
             path.dirname(scriptPath),
             question.image_url,
           );
           console.log(`Uploading question image from: ${imagePath}`);
           try {
-            const uploadedUrl = await this.uploadImageToSupabase(imagePath);
+            const uploadedUrl = await upload(imagePath);
             console.log(`Successfully uploaded to: ${uploadedUrl}`);
             question.image_url = uploadedUrl;
           } catch (e) {
@@ -126,14 +170,16 @@ export class QuestionsService {
             question.image_url = null;
           }
         }
-        if (question.explanation_image_url) {
+        if (
+          question.explanation_image_url &&
+          !isUrl(question.explanation_image_url)
+        ) {
           const imagePath = path.join(
             path.dirname(scriptPath),
             question.explanation_image_url,
           );
           try {
-            question.explanation_image_url =
-              await this.uploadImageToSupabase(imagePath);
+            question.explanation_image_url = await upload(imagePath);
           } catch (e) {
             console.error(
               `Failed to upload explanation image ${question.explanation_image_url}:`,
@@ -157,27 +203,16 @@ export class QuestionsService {
       await fs.unlink(pdfPath).catch(() => {});
       await fs.unlink(jsonPath).catch(() => {});
 
-
-      // 6. Cleanup extracted images folder
-      const extractedImagesDir = path.join(
+      // 6. Cleanup this upload's image workspace (the script also removes
+      // workspaces left behind by crashed runs after a day)
+      const jobImagesDir = path.join(
         path.dirname(scriptPath),
         'extracted_images',
+        jobId,
       );
-
-      try {
-        // Check if directory exists
-        await fs.access(extractedImagesDir);
-        // Remove all files in the directory
-        const files = await fs.readdir(extractedImagesDir);
-        await Promise.all(
-          files.map((file) =>
-            fs.unlink(path.join(extractedImagesDir, file)).catch(() => {}),
-          ),
-        );
-        console.log(`Cleaned up ${files.length} extracted images`);
-      } catch {
-        // Directory doesn't exist or other error, ignore
-      }
+      await fs
+        .rm(jobImagesDir, { recursive: true, force: true })
+        .catch(() => {});
     }
   }
 
@@ -188,7 +223,9 @@ export class QuestionsService {
     const { data, error } = await this.supabase.storage
       .from('images')
       .upload(fileName, fileContent, {
-        contentType: 'image/png', // Python script saves as PNG
+        contentType:
+          IMAGE_CONTENT_TYPES[path.extname(localPath).toLowerCase()] ??
+          'image/png',
         upsert: false,
       });
 